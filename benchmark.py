@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Callable, Dict, Iterable, List, Optional
+import pandas as pd
+from services import AWS_SERVICES, AWS_REGIONS
+from data_generator import BillingDataGenerator
+from cur_formatter import CURFormatter
+from patterns import SERVICE_PROFILES
+
+SEED = 0
+
+# Timed runs per metric after one untimed warm-up run; their median is reported
+REPEATS = 7
+
+# Shortest timed run; quick calls are repeated until it passes so they are not timed at clock resolution
+MIN_SECONDS = 0.2
+
+# Standard scenarios: regions and services generated, with every option of each service enabled
+SCENARIOS = {
+    'single': {'regions': ['us-east-1'], 'services': ['EC2'], 'days': 30},
+    'all_regions_services': {'regions': AWS_REGIONS, 'services': list(AWS_SERVICES), 'days': 90},
+    'fleet': {'regions': ['us-east-1'], 'services': ['EC2', 'S3'], 'days': 30,
+              'num_accounts': 10, 'resources_per_option': 20},
+}
+
+# Output formats whose peak RSS is measured, each streaming day chunks into its writer in one process
+WRITERS: Dict[str, Callable[[Iterable[pd.DataFrame], str], int]] = {
+    'csv': lambda chunks, path: CURFormatter.write_cur_csv(chunks, path),
+    'csv_gzip': lambda chunks, path: CURFormatter.write_cur_csv_parts(chunks, path, 'gzip', workers=1),
+    'parquet': lambda chunks, path: CURFormatter.write_cur_parquet(chunks, path, 'zstd'),
+}
+
+def _scenario_services(service_names: List[str]) -> Dict[str, Dict[str, float]]:
+    """Enable every option of the given services at a quarter of its range"""
+    return {
+        name: {option.name: (option.min_value + option.max_value) / 4 for option in AWS_SERVICES[name].options}
+        for name in service_names
+    }
+
+def _dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def _median_rates(works: Dict[str, Callable[[], int]], repeats: int) -> Dict[str, float]:
+    """Median units per second of each work, which returns the units it processed
+
+    Works are warmed up once, then timed round-robin, so a slow spell of the host is spread across
+    metrics instead of landing on every run of one of them.
+    """
+    for work in works.values():
+        work()
+    rates: Dict[str, List[float]] = {metric: [] for metric in works}
+    for _ in range(repeats):
+        for metric, work in works.items():
+            units, start = 0, time.perf_counter()
+            while True:
+                units += work()
+                elapsed = time.perf_counter() - start
+                if elapsed >= MIN_SECONDS:
+                    break
+            rates[metric].append(units / elapsed)
+    return {metric: statistics.median(values) for metric, values in rates.items()}
+
+def _scenario_generators(name: str) -> List[BillingDataGenerator]:
+    scenario = SCENARIOS[name]
+    services = _scenario_services(scenario['services'])
+    return [
+        BillingDataGenerator(services, region, scenario['days'], seed=SEED,
+                             num_accounts=scenario.get('num_accounts', 1),
+                             resources_per_option=scenario.get('resources_per_option', 1))
+        for region in scenario['regions']
+    ]
+
+def write_peak_rss(name: str, output_format: str) -> float:
+    """Peak RSS in MB of streaming a scenario's day chunks into one writer; run it in a fresh process"""
+    chunks = (chunk for generator in _scenario_generators(name) for chunk in generator.iter_chunks(chunk_by='day'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        WRITERS[output_format](chunks, os.path.join(tmp_dir, 'output'))
+    return _peak_rss_mb()
+
+def run_scenario(name: str, repeats: int = REPEATS) -> Dict[str, float]:
+    """Run one scenario and return its throughput and output size metrics"""
+    scenario = SCENARIOS[name]
+    services = _scenario_services(scenario['services'])
+    generators = _scenario_generators(name)
+    hours = scenario['days'] * 24
+    # The same series from the realistic profile of the scenario's first service
+    realistic = BillingDataGenerator(services, scenario['regions'][0], scenario['days'], seed=SEED,
+                                     num_accounts=generators[0].num_accounts,
+                                     resources_per_option=generators[0].resources_per_option,
+                                     usage_profiles=SERVICE_PROFILES)
+    service_name = scenario['services'][0]
+    option_name = next(iter(services[service_name]))
+    frames = []
+
+    def generate() -> int:
+        frames[:] = [generator.generate_data() for generator in generators]
+        return sum(len(frame) for frame in frames)
+
+    def write(writer: Callable[[], object]) -> Callable[[], int]:
+        def run() -> int:
+            writer()
+            return sum(len(frame) for frame in frames)
+        return run
+
+    try:
+        import pyarrow
+    except ImportError:
+        pyarrow = None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Each run replaces the previous run's output, as a fresh write does
+        paths = {name: os.path.join(tmp_dir, name) for name in ('billing.csv', 'csv_parts', 'parquet')}
+        works = {
+            'usage_pattern_points_per_sec':
+                lambda: generators[0].generate_usage_patterns(100.0, hours, generators[0].num_series).size,
+            'profile_pattern_points_per_sec':
+                lambda: realistic._profile_patterns(service_name, option_name, 100.0, realistic.first_epoch_hour,
+                                                    hours).size,
+            # Runs before the writers in every round, which write the frames it generated
+            'generate_rows_per_sec': generate,
+            'csv_rows_per_sec': write(lambda: CURFormatter.write_cur_csv(frames, paths['billing.csv'])),
+            'csv_gzip_rows_per_sec': write(lambda: CURFormatter.write_cur_csv_parts(frames, paths['csv_parts'], 'gzip')),
+        }
+        if pyarrow is not None:
+            works['parquet_rows_per_sec'] = write(
+                lambda: CURFormatter.write_cur_parquet(frames, paths['parquet'], 'zstd'))
+        results = _median_rates(works, repeats)
+        results['rows'] = sum(len(frame) for frame in frames)
+        results['csv_bytes'] = os.path.getsize(paths['billing.csv'])
+        results['csv_gzip_bytes'] = _dir_size(paths['csv_parts'])
+        if pyarrow is not None:
+            results['parquet_bytes'] = _dir_size(paths['parquet'])
+    return results
+
+def _in_fresh_process(function: Callable, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        return executor.submit(function, *args).result()
+
+def run_benchmarks(names: List[str], repeats: int = REPEATS) -> Dict[str, Dict[str, float]]:
+    """Run each scenario, then measure each format's peak RSS in a process of its own"""
+    results = {}
+    for name in names:
+        results[name] = _in_fresh_process(run_scenario, name, repeats)
+        for output_format in WRITERS:
+            try:
+                results[name][f'{output_format}_peak_rss_mb'] = _in_fresh_process(write_peak_rss, name, output_format)
+            except ImportError:
+                # Parquet is skipped without pyarrow, as in run_scenario
+                pass
+    return results
+
+def find_regressions(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+                     tolerance: float) -> List[str]:
+    """List throughput metrics that fell more than tolerance below the baseline"""
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            expected = baseline.get(name, {}).get(metric)
+            if metric.endswith('_per_sec') and expected and value < expected * (1 - tolerance):
+                regressions.append(f"{name}.{metric}: {value:,.0f} vs baseline {expected:,.0f}")
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark billing data generation and formatting throughput")
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS), help="Scenario to run (default: all)")
+    parser.add_argument('--output', help="Write results as a JSON baseline to this file")
+    parser.add_argument('--baseline', help="Compare against a JSON baseline and exit non-zero on regressions")
+    parser.add_argument('--repeats', type=int, default=REPEATS, help="Timed runs per metric; the median is reported")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed throughput drop against the baseline")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.scenario or list(SCENARIOS), args.repeats)
+    for name, metrics in results.items():
+        print(name)
+        for metric, value in metrics.items():
+            print(f"  {metric:32} {value:,.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
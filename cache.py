@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Callable, Dict, Optional
+from pricing import default_pricing_index
+
+# Bump when a generator or formatter change alters the output for the same inputs
+CACHE_FORMAT_VERSION = 4
+
+def catalog_version() -> str:
+    """Digest of the built-in service catalog, so pricing changes invalidate cached results"""
+    return default_pricing_index().version
+
+class ResultCache:
+    """On-disk cache of generated artifacts keyed by a hash of their inputs, with size-based LRU eviction"""
+
+    def __init__(self, directory: str, max_bytes: int = 1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(config: Dict, days: int, seed: int, catalog: Optional[str] = None, **options) -> str:
+        """Hash the config, days, seed, catalog version and any output options into a cache key"""
+        payload = {
+            'config': config,
+            'days': days,
+            'seed': seed,
+            'catalog': catalog or catalog_version(),
+            'format_version': CACHE_FORMAT_VERSION,
+            'options': options,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the entry directory for key, marking it as recently used, or None on a miss"""
+        path = self._entry_path(key)
+        if not os.path.isdir(path):
+            return None
+        os.utime(path)
+        return path
+
+    def put(self, key: str, build: Callable[[str], None]) -> str:
+        """Run build(directory) to fill a new entry, store it under key and return its directory"""
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+        try:
+            build(tmp_dir)
+            path = self._entry_path(key)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.replace(tmp_dir, path)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self._evict(keep=key)
+        return path
+
+    def get_or_create(self, key: str, build: Callable[[str], None]) -> str:
+        """Return the cached entry for key, building it first on a miss"""
+        return self.get(key) or self.put(key, build)
+
+    def _evict(self, keep: str):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = self._entry_path(name)
+            if name.startswith('.tmp-') or not os.path.isdir(path):
+                continue
+            entries.append((os.path.getmtime(path), _dir_size(path), name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(self._entry_path(name), ignore_errors=True)
+            total -= size
+
+def _dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
@@ -1,36 +1,340 @@
+import gzip
+import json
+import os
+import re
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import numpy as np
 import pandas as pd
-from typing import List
+
+# CUR 2.0 column order
+CUR_COLUMNS = [
+    'identity/TimeInterval',
+    'identity/LineItemId',
+    'bill/PayerAccountId',
+    'bill/BillingPeriodStartDate',
+    'bill/BillingPeriodEndDate',
+    'lineItem/UsageAccountId',
+    'lineItem/ProductCode',
+    'lineItem/UsageType',
+    'lineItem/Operation',
+    'lineItem/AvailabilityZone',
+    'lineItem/ResourceId',
+    'lineItem/UsageStartDate',
+    'lineItem/UsageEndDate',
+    'lineItem/UsageAmount',
+    'lineItem/NormalizedUsageAmount',
+    'lineItem/UnblendedRate',
+    'lineItem/UnblendedCost',
+    'lineItem/BlendedRate',
+    'lineItem/BlendedCost',
+    'lineItem/LineItemDescription',
+    'product/ProductName',
+    'product/region',
+    'pricing/unit'
+]
+
+CSV_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+CUR_TIMESTAMP_COLUMNS = [
+    'bill/BillingPeriodStartDate',
+    'bill/BillingPeriodEndDate',
+    'lineItem/UsageStartDate',
+    'lineItem/UsageEndDate'
+]
+
+CUR_FLOAT_COLUMNS = [
+    'lineItem/UsageAmount',
+    'lineItem/NormalizedUsageAmount',
+    'lineItem/UnblendedRate',
+    'lineItem/UnblendedCost',
+    'lineItem/BlendedRate',
+    'lineItem/BlendedCost'
+]
+
+# Columns with unique values per line item; every other string column repeats and is dictionary-encoded
+CUR_UNIQUE_COLUMNS = ['identity/LineItemId']
+
+PARQUET_COMPRESSIONS = ['snappy', 'zstd', 'gzip', 'none']
+
+# CSV part file compressions and their file extensions
+CSV_COMPRESSIONS = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+
+# Largest slice of a chunk encoded as one job, so a single large frame still spreads across workers
+CSV_ENCODE_ROWS = 100_000
+
+def _parquet_schema():
+    """Build the typed CUR 2.0 Parquet schema"""
+    import pyarrow as pa
+    fields = []
+    for column in CUR_COLUMNS:
+        if column in CUR_TIMESTAMP_COLUMNS:
+            fields.append(pa.field(column, pa.timestamp('ms')))
+        elif column in CUR_FLOAT_COLUMNS:
+            fields.append(pa.field(column, pa.float64()))
+        elif column in CUR_UNIQUE_COLUMNS:
+            fields.append(pa.field(column, pa.string()))
+        else:
+            fields.append(pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+    return pa.schema(fields)
+
+def _next_part(directory: str, name: str) -> int:
+    """First unused number for a part file name template, so later writes add files instead of replacing them"""
+    part = 1
+    while os.path.exists(os.path.join(directory, name.format(part))):
+        part += 1
+    return part
+
+def _is_output_entry(name: str, report_name: str) -> bool:
+    """Whether a directory entry is part of a CUR output: parts, partitions, the manifest or '_' metadata files"""
+    return (name.startswith('_') or name.startswith('BILLING_PERIOD=') or name == f"{report_name}-Manifest.json"
+            or re.fullmatch(rf"{re.escape(report_name)}-\d{{5}}\.csv(\.gz|\.zst)?", name) is not None)
+
+def clear_output_dir(output_dir: str, report_name: str = 'billing'):
+    """Remove a previous CUR output from output_dir so a fresh write replaces it instead of adding to it
+
+    A directory that holds anything else is refused rather than emptied.
+    """
+    if not os.path.isdir(output_dir):
+        return
+    entries = os.listdir(output_dir)
+    other = sorted(name for name in entries if not _is_output_entry(name, report_name))
+    if other:
+        raise ValueError(f"{output_dir} holds files that are not CUR output: {', '.join(other[:3])}")
+    for name in entries:
+        path = os.path.join(output_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+def _csv_quote(value: str) -> str:
+    if any(char in value for char in ',"\r\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+def _csv_field_values(column: pd.Series) -> List[str]:
+    """One column as CSV-ready strings, formatting each distinct category or timestamp only once"""
+    if column.dtype.kind in 'fiub':
+        values = column.to_numpy()
+        strings = values.astype(str)
+        if column.dtype.kind == 'f':
+            strings[np.isnan(values)] = ''
+        return strings.tolist()
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        codes, labels = column.cat.codes.to_numpy(), column.cat.categories
+    elif column.dtype.kind == 'M':
+        codes, labels = pd.factorize(column)
+    else:
+        # Unique per-row strings such as LineItemId; only the rare values that need it are quoted
+        strings = column.astype(str).where(column.notna(), '')
+        needs_quotes = strings.str.contains(r'[,"\r\n]', regex=True).to_numpy()
+        values = strings.to_numpy(dtype=object)
+        values[needs_quotes] = [_csv_quote(value) for value in values[needs_quotes]]
+        return values.tolist()
+    if isinstance(labels, pd.DatetimeIndex):
+        labels = labels.strftime(CSV_DATE_FORMAT)
+    # A trailing empty label is picked up by the -1 code of missing values
+    labels = np.array([_csv_quote(str(label)) for label in labels] + [''], dtype=object)
+    return labels[codes].tolist()
+
+def _encode_csv(df: pd.DataFrame, header: bool) -> str:
+    """Encode the CUR columns of a frame as CSV text, matching DataFrame.to_csv output"""
+    columns = [_csv_field_values(df[column]) for column in CUR_COLUMNS]
+    lines = [','.join(CUR_COLUMNS)] if header else []
+    lines.extend(map(','.join, zip(*columns)))
+    return '\n'.join(lines) + '\n' if lines else ''
+
+def _encode_csv_part(chunk: pd.DataFrame, header: bool, compression: str) -> bytes:
+    """Encode one slice of a part file; gzip slices are independent members, which concatenate into a valid file"""
+    data = _encode_csv(chunk, header).encode()
+    if compression == 'gzip':
+        return gzip.compress(data, compresslevel=6)
+    return data
+
+def _zstd_compressor():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd CSV output requires zstandard: pip install zstandard")
+    # zstandard compresses on its own threads, so zstd parts are streamed through one compressor
+    return zstandard.ZstdCompressor(threads=-1)
+
+def _split_parts(chunks: Iterable[pd.DataFrame], rows_per_part: Optional[int]) -> Iterator[Tuple[int, pd.DataFrame]]:
+    """Slice chunks into encoding jobs, yielding (part number from 0, slice)"""
+    part, part_rows = 0, 0
+    for chunk in chunks:
+        start = 0
+        while start < len(chunk):
+            if rows_per_part and part_rows == rows_per_part:
+                part, part_rows = part + 1, 0
+            size = min(len(chunk) - start, CSV_ENCODE_ROWS)
+            if rows_per_part:
+                size = min(size, rows_per_part - part_rows)
+            yield part, chunk.iloc[start:start + size]
+            start += size
+            part_rows += size
+
+def _map_ordered(function, jobs: Iterable[Tuple], workers: int) -> Iterator:
+    """Apply function to each job tuple in a process pool, yielding results in job order with bounded lookahead"""
+    if workers <= 1:
+        yield from (function(*job) for job in jobs)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for job in jobs:
+            pending.append(executor.submit(function, *job))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _open_csv_part(path: str, compressor) -> IO[bytes]:
+    sink = open(path, 'wb')
+    return compressor.stream_writer(sink) if compressor is not None else sink
+
+def _csv_manifest_path(output_dir: str, report_name: str) -> str:
+    return os.path.join(output_dir, f"{report_name}-Manifest.json")
 
 class CURFormatter:
     @staticmethod
     def format_cur_csv(df: pd.DataFrame) -> str:
         """Format DataFrame as CUR 2.0 CSV string"""
-        # Ensure correct column order
-        columns = [
-            'identity/TimeInterval',
-            'identity/LineItemId',
-            'bill/PayerAccountId',
-            'bill/BillingPeriodStartDate',
-            'bill/BillingPeriodEndDate',
-            'lineItem/UsageAccountId',
-            'lineItem/ProductCode',
-            'lineItem/UsageType',
-            'lineItem/Operation',
-            'lineItem/AvailabilityZone',
-            'lineItem/ResourceId',
-            'lineItem/UsageStartDate',
-            'lineItem/UsageEndDate',
-            'lineItem/UsageAmount',
-            'lineItem/NormalizedUsageAmount',
-            'lineItem/UnblendedRate',
-            'lineItem/UnblendedCost',
-            'lineItem/BlendedRate',
-            'lineItem/BlendedCost',
-            'lineItem/LineItemDescription',
-            'product/ProductName',
-            'product/region',
-            'pricing/unit'
-        ]
-        
-        df = df[columns]
-        return df.to_csv(index=False)
+        return _encode_csv(df, header=True)
+
+    @staticmethod
+    def write_cur_csv(chunks: Iterable[pd.DataFrame], sink: Union[str, IO[str]], append: bool = False) -> int:
+        """Write DataFrame chunks to a CUR 2.0 CSV file or file-like sink, returning rows written"""
+        if isinstance(sink, str):
+            exists = append and os.path.exists(sink) and os.path.getsize(sink) > 0
+            with open(sink, 'a' if append else 'w', newline='') as f:
+                return CURFormatter.write_cur_csv(chunks, f, append=exists)
+        rows = 0
+        header = not append
+        for chunk in chunks:
+            sink.write(_encode_csv(chunk, header))
+            header = False
+            rows += len(chunk)
+        if header:
+            sink.write(','.join(CUR_COLUMNS) + '\n')
+        return rows
+
+    @staticmethod
+    def write_cur_csv_parts(chunks: Iterable[pd.DataFrame], output_dir: str, compression: str = 'gzip',
+                            rows_per_part: Optional[int] = None, workers: Optional[int] = None,
+                            report_name: str = 'billing', append: bool = False) -> int:
+        """Write DataFrame chunks as numbered, optionally compressed CUR 2.0 CSV part files plus a manifest
+
+        Slices are encoded and compressed in a pool of worker processes and streamed to disk in order.
+        Each part holds at most rows_per_part rows under its own header, like AWS CUR CSV deliveries,
+        With append, existing parts and manifest entries in output_dir are kept; otherwise a previous
+        output there is replaced. Returns rows written.
+        """
+        if compression not in CSV_COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression}")
+        if not append:
+            clear_output_dir(output_dir, report_name)
+        compressor = _zstd_compressor() if compression == 'zstd' else None
+        extension = CSV_COMPRESSIONS[compression]
+        os.makedirs(output_dir, exist_ok=True)
+        manifest_path = _csv_manifest_path(output_dir, report_name)
+        manifest = {'reportName': report_name, 'reportKeys': [], 'rowCounts': [], 'billingPeriod': None}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        first_part = _next_part(output_dir, f"{report_name}-{{:05d}}.csv{extension}")
+        part_rows: Dict[int, int] = {}
+        job_parts = deque()
+        usage_period = []
+
+        def jobs():
+            for part, piece in _split_parts(chunks, rows_per_part):
+                header = part not in part_rows
+                part_rows[part] = part_rows.get(part, 0) + len(piece)
+                usage_period.extend([piece['lineItem/UsageStartDate'].min(), piece['lineItem/UsageEndDate'].max()])
+                job_parts.append(part)
+                yield piece, header, compression
+
+        keys: List[str] = []
+        sink = None
+        try:
+            for data in _map_ordered(_encode_csv_part, jobs(), workers or os.cpu_count() or 1):
+                part = job_parts.popleft()
+                if part == len(keys):
+                    if sink is not None:
+                        sink.close()
+                    keys.append(f"{report_name}-{first_part + part:05d}.csv{extension}")
+                    sink = _open_csv_part(os.path.join(output_dir, keys[-1]), compressor)
+                sink.write(data)
+            if not keys and not manifest['reportKeys']:
+                # Like write_cur_csv, an empty result still gets a header-only file
+                keys.append(f"{report_name}-{first_part:05d}.csv{extension}")
+                part_rows[0] = 0
+                sink = _open_csv_part(os.path.join(output_dir, keys[-1]), compressor)
+                sink.write(_encode_csv_part(pd.DataFrame(columns=CUR_COLUMNS), True, compression))
+        finally:
+            if sink is not None:
+                sink.close()
+
+        if usage_period:
+            start = pd.Timestamp(min(usage_period)).strftime(CSV_DATE_FORMAT)
+            end = pd.Timestamp(max(usage_period)).strftime(CSV_DATE_FORMAT)
+            if manifest['billingPeriod']:
+                start = min(start, manifest['billingPeriod']['start'])
+                end = max(end, manifest['billingPeriod']['end'])
+            manifest['billingPeriod'] = {'start': start, 'end': end}
+        manifest.update({
+            'compression': compression.upper() if compression != 'none' else None,
+            'contentType': 'text/csv',
+            'charset': 'UTF-8',
+            'columns': [dict(zip(('category', 'name'), column.split('/', 1))) for column in CUR_COLUMNS],
+            'reportKeys': manifest['reportKeys'] + keys,
+            'rowCounts': manifest['rowCounts'] + [part_rows[part] for part in range(len(keys))],
+        })
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        return sum(part_rows.values())
+
+    @staticmethod
+    def write_cur_parquet(chunks: Iterable[pd.DataFrame], output_dir: str, compression: str = 'snappy',
+                          append: bool = False) -> int:
+        """Write DataFrame chunks as CUR 2.0 Parquet partitioned by BILLING_PERIOD, returning rows written
+
+        With append, new part files are added next to the existing ones; otherwise a previous output is replaced.
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow: pip install pyarrow")
+        if compression not in PARQUET_COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression}")
+        if not append:
+            clear_output_dir(output_dir)
+        schema = _parquet_schema()
+        writers: Dict[str, 'pq.ParquetWriter'] = {}
+        rows = 0
+        try:
+            for chunk in chunks:
+                chunk = chunk[CUR_COLUMNS].copy()
+                for column in CUR_TIMESTAMP_COLUMNS:
+                    chunk[column] = pd.to_datetime(chunk[column])
+                # AWS delivers one partition per calendar month of usage
+                periods = chunk['lineItem/UsageStartDate'].dt.strftime('%Y-%m')
+                for period, part in chunk.groupby(periods, sort=False):
+                    if period not in writers:
+                        partition_dir = os.path.join(output_dir, f"BILLING_PERIOD={period}")
+                        os.makedirs(partition_dir, exist_ok=True)
+                        name = "part-{:05d}.parquet"
+                        writers[period] = pq.ParquetWriter(
+                            os.path.join(partition_dir, name.format(_next_part(partition_dir, name))), schema,
+                            compression=compression)
+                    table = pa.Table.from_pandas(part, preserve_index=False).cast(schema)
+                    writers[period].write_table(table)
+                rows += len(chunk)
+        finally:
+            for writer in writers.values():
+                writer.close()
+        return rows
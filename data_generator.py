@@ -1,27 +1,376 @@
+import hashlib
 import pandas as pd
+from pandas.api.types import union_categoricals
 import numpy as np
-from datetime import datetime, timedelta
-from typing import Dict, List
-from services import AWS_SERVICES, AWSService
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+from services import AWS_SERVICES
+from pricing import PricingIndex, default_pricing_index
+from summary import CostSummary
+from profiling import RunProfile
+from patterns import PatternContext, UsageProfile, resolve_profile
+from cur_formatter import CUR_COLUMNS
+
+DtypeUnion = Tuple[pd.CategoricalDtype, List[np.ndarray]]
+
+def _union_dtype(dtypes: Tuple[pd.CategoricalDtype, ...]) -> DtypeUnion:
+    """Union of categorical dtypes in order of appearance and each one's code mapping into it"""
+    categories = pd.Index(np.concatenate([dtype.categories.to_numpy(dtype=object) for dtype in dtypes])).unique()
+    code_type = np.min_scalar_type(-len(categories))
+    return pd.CategoricalDtype(categories), [categories.get_indexer(dtype.categories).astype(code_type) for dtype in dtypes]
+
+def _concat_blocks(blocks: List[Dict[str, np.ndarray]],
+                   unions: Dict[Tuple[pd.CategoricalDtype, ...], DtypeUnion]) -> Dict[str, np.ndarray]:
+    """Concatenate column blocks column by column, merging categorical dictionaries
+
+    Day chunks concatenate the same option dtypes every day, so each union is worked out once and kept in unions.
+    """
+    columns = {}
+    for column in CUR_COLUMNS:
+        parts = [block[column] for block in blocks]
+        if isinstance(parts[0], pd.Categorical):
+            key = tuple(part.dtype for part in parts)
+            if key not in unions:
+                unions[key] = _union_dtype(key)
+            dtype, mappings = unions[key]
+            codes = np.concatenate([mapping[part.codes] for mapping, part in zip(mappings, parts)])
+            columns[column] = pd.Categorical.from_codes(codes, dtype=dtype, validate=False)
+        else:
+            columns[column] = np.concatenate(parts)
+    return columns
+
+def concat_chunks(chunks: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate generated DataFrames, keeping categorical columns categorical"""
+    if not chunks:
+        return pd.DataFrame(columns=CUR_COLUMNS)
+    columns = {}
+    for column in CUR_COLUMNS:
+        parts = [chunk[column] for chunk in chunks]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            columns[column] = union_categoricals(parts)
+        else:
+            columns[column] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns, columns=CUR_COLUMNS)
+
+def _stable_id(*parts) -> str:
+    """Short hex digest of the parts; unlike hash() it is the same in every process"""
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()[:16]
+
+def _stable_int(*parts) -> int:
+    """Process-independent integer digest of the parts"""
+    return int(_stable_id(*parts), 16)
 
 class BillingDataGenerator:
-    def __init__(self, selected_services: Dict[str, Dict], selected_region: str, days: int):
+    def __init__(self, selected_services: Dict[str, Dict], selected_region: str, days: int,
+                 num_accounts: int = 1, resources_per_option: int = 1,
+                 seed: Optional[int] = None, end_date: Optional[datetime] = None,
+                 pricing: Optional[PricingIndex] = None, profile: Optional[RunProfile] = None,
+                 usage_profiles: Optional[Dict[str, UsageProfile]] = None, pattern_origin: Optional[datetime] = None,
+                 billing_period: Optional[Tuple[datetime, datetime]] = None):
+        if num_accounts < 1 or resources_per_option < 1:
+            raise ValueError("num_accounts and resources_per_option must be at least 1")
         self.selected_services = selected_services
         self.selected_region = selected_region
         self.days = days
-        self.end_date = datetime.now()
-        self.start_date = self.end_date - timedelta(days=days)
+        self.hours = int(round(days * 24))
+        self.num_accounts = num_accounts
+        self.resources_per_option = resources_per_option
+        self.seed = seed
+        self.pricing = pricing or default_pricing_index()
+        self.region_id = self.pricing.region_id(selected_region)
+        if end_date is None:
+            # Seeded runs anchor on midnight so reruns on the same day reproduce the same window
+            end_date = datetime.now() if seed is None else datetime.combine(date.today(), datetime.min.time())
+        self.end_date = end_date
+        self.start_date = self.end_date - timedelta(hours=self.hours)
+        # Dates reported in the bill/ columns; a part of a larger output passes that output's period
+        self.billing_period = billing_period or (self.start_date, self.end_date)
+        self.summary = CostSummary()
+        # Categorical dtypes and their unions, shared by every block and day of this generator so each is
+        # validated once; kept per generator so they are released with it
+        self._dtypes: Dict[Tuple, pd.CategoricalDtype] = {}
+        self._dtype_unions: Dict[Tuple[pd.CategoricalDtype, ...], DtypeUnion] = {}
+        # Stage timings accumulate across runs into the caller's profile; without one they are skipped
+        self.profile = profile or RunProfile(enabled=False)
+        # Usage profiles by service code or "service/option" (see patterns.py); None keeps the classic cycle
+        self.usage_profiles = usage_profiles
+        # Growth trends count from the origin, so extending a series keeps growing from the same point
+        self.pattern_origin = np.datetime64(pattern_origin or self.start_date, 'h')
+        # Patterns always draw from seeded per-day streams, so any day is generated without the days before it;
+        # unseeded runs take a seed from np.random
+        self._stream_seed = seed if seed is not None else int(np.random.randint(2 ** 31))
+        # Seeded patterns are phased on the absolute hour so any window of them can be regenerated on its own
+        self.first_epoch_hour = int((pd.Timestamp(self.start_date) - pd.Timestamp(0)) // pd.Timedelta(hours=1))
 
     def generate_usage_pattern(self, mean_value: float, num_points: int) -> np.ndarray:
         """Generate realistic usage patterns with daily and weekly cycles"""
-        base = np.random.normal(mean_value, mean_value * 0.1, num_points)
-        hours = np.arange(num_points) % 24
+        return self.generate_usage_patterns(mean_value, num_points, 1)[0]
+
+    def generate_usage_patterns(self, mean_value: float, num_points: int, num_series: int,
+                                rng=None, first_hour: int = 0, noise: Optional[np.ndarray] = None) -> np.ndarray:
+        """Generate one usage pattern per resource in a single batched draw; first_hour shifts the cycles and noise replaces the normal draw"""
+        rng = np.random if rng is None else rng
+        if noise is None:
+            base = rng.normal(mean_value, mean_value * 0.1, (num_series, num_points))
+        else:
+            base = mean_value + mean_value * 0.1 * noise
+        if num_series > 1:
+            # Give each resource its own scale so a fleet is not num_series copies of one workload
+            base *= rng.uniform(0.5, 1.5, (num_series, 1))
+        hours = (first_hour + np.arange(num_points)) % 24
         daily_pattern = np.sin(hours * 2 * np.pi / 24) * 0.2 * mean_value
-        days = np.arange(num_points) % 168
+        days = (first_hour + np.arange(num_points)) % 168
         weekly_pattern = (days < 120).astype(float) * 0.15 * mean_value
         return np.maximum(base + daily_pattern + weekly_pattern, 0)
 
-    def generate_data(self) -> pd.DataFrame:
+    def _option_rng(self, service_name: str, option_name: str):
+        """Random source for one option: an independent stream derived from the stream seed"""
+        spawn_key = (_stable_int(self.selected_region, service_name, option_name),)
+        return np.random.default_rng(np.random.SeedSequence(self._stream_seed, spawn_key=spawn_key))
+
+    def _seeded_noise(self, service_name: str, option_name: str, first_hour: int, num_points: int) -> np.ndarray:
+        """Standard normal noise drawn per UTC day, so any range of hours can be regenerated without the rest"""
+        key = _stable_int(self.selected_region, service_name, option_name)
+        first_day = first_hour // 24
+        last_day = (first_hour + num_points - 1) // 24
+        noise = np.concatenate([
+            np.random.default_rng(np.random.SeedSequence(self._stream_seed, spawn_key=(key, day))).standard_normal((self.num_series, 24))
+            for day in range(first_day, last_day + 1)
+        ], axis=1)
+        offset = first_hour - first_day * 24
+        return noise[:, offset:offset + num_points]
+
+    def _day_draws(self, service_name: str, option_name: str, first_hour: int, num_points: int,
+                   stream: int, k: int) -> np.ndarray:
+        """k uniform draws per resource and UTC day from a numbered stream, shaped (resources, days, k)"""
+        key = _stable_int(self.selected_region, service_name, option_name)
+        days = range(first_hour // 24, (first_hour + num_points - 1) // 24 + 1)
+        return np.stack([
+            np.random.default_rng(np.random.SeedSequence(self._stream_seed, spawn_key=(key, day, stream))).random((self.num_series, k))
+            for day in days
+        ], axis=1)
+
+    def _profile_patterns(self, service_name: str, option_name: str, usage_value: float,
+                          first_hour: int, num_points: int) -> np.ndarray:
+        """Usage patterns of one option from its usage profile, for num_points hours from an absolute epoch hour"""
+        profile, stream_option, correlation = resolve_profile(self.usage_profiles, service_name, option_name)
+        noise = self._seeded_noise(service_name, stream_option, first_hour, num_points)
+        if correlation < 1:
+            # Mix in the follower's own noise, keeping unit variance
+            own = self._seeded_noise(service_name, option_name, first_hour, num_points)
+            noise = correlation * noise + np.sqrt(1 - correlation ** 2) * own
+        context = PatternContext(
+            index=np.datetime64(first_hour, 'h') + np.arange(num_points),
+            origin=self.pattern_origin,
+            noise=noise,
+            day_draws=lambda stream, k: self._day_draws(service_name, stream_option, first_hour, num_points, stream, k),
+        )
+        scale = None
+        if self.num_series > 1:
+            # Followers draw the same per-resource scale as the option they follow
+            scale = self._option_rng(service_name, stream_option).uniform(0.5, 1.5, (self.num_series, 1))
+        return profile.patterns(usage_value, context, scale)
+
+    def _option_patterns(self, service_name: str, sku: int, usage_value: float,
+                         start_hour: int, num_points: int) -> np.ndarray:
+        """Usage patterns of one option for num_points hours starting start_hour hours into the window"""
+        with self.profile.stage('usage_patterns') as stage:
+            if self.usage_profiles is not None:
+                patterns = self._profile_patterns(service_name, self.pricing.option_names[sku], usage_value,
+                                                  self.first_epoch_hour + start_hour, num_points)
+            else:
+                option_name = self.pricing.option_names[sku]
+                first_hour = self.first_epoch_hour + start_hour
+                patterns = self.generate_usage_patterns(usage_value, num_points, self.num_series,
+                                                        self._option_rng(service_name, option_name), first_hour,
+                                                        self._seeded_noise(service_name, option_name, first_hour, num_points))
+            stage.rows = patterns.size
+        return patterns
+
+    @property
+    def num_series(self) -> int:
+        """Number of resources generated for each option across all accounts"""
+        return self.num_accounts * self.resources_per_option
+
+    def account_ids(self) -> List[str]:
+        """Usage account IDs; the first one is also the payer account"""
+        return [f"{123456789012 + i:012d}" for i in range(self.num_accounts)]
+
+    def availability_zones(self) -> List[str]:
+        """Availability zones resources are spread across"""
+        if self.num_series == 1:
+            return [f"{self.selected_region}a"]
+        return [f"{self.selected_region}{zone}" for zone in 'abc']
+
+    def _active_options(self) -> List[Tuple[str, int, float]]:
+        """List the (service, SKU ID, usage) combinations that produce line items"""
+        active = []
+        for service_name, options in self.selected_services.items():
+            for sku in self.pricing.service_skus(service_name):
+                option_name = self.pricing.option_names[sku]
+                if option_name in options:
+                    usage_value = float(options[option_name])
+                    if usage_value > 0:
+                        active.append((service_name, int(sku), usage_value))
+        return active
+
+    def _time_columns(self, hours: int) -> Dict[str, np.ndarray]:
+        """Build the per-hour columns shared by every option block"""
+        timestamps = pd.date_range(self.start_date, periods=hours, freq=pd.Timedelta(hours=1))
+        day = timestamps.strftime('%Y-%m-%d')
+        next_day = (timestamps + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+        # Usage dates stay datetime64 (truncated to the second like the CSV output) until the formatter serialises them
+        usage_start = timestamps.floor('s')
+        epoch_hour = (timestamps - pd.Timestamp(0)) // pd.Timedelta(hours=1)
+        day_codes, day_labels = pd.factorize(day)
+        return {
+            'day_code': day_codes,
+            'day_labels': list(day_labels),
+            'identity/TimeInterval': pd.Categorical(day + 'T00:00:00Z/' + next_day + 'T00:00:00Z'),
+            'epoch_hour': np.asarray(epoch_hour).astype(str).astype(object),
+            'lineItem/UsageStartDate': usage_start.to_numpy(),
+            'lineItem/UsageEndDate': (usage_start + pd.Timedelta(hours=1)).to_numpy(),
+        }
+
+    def _build_block(self, service_name: str, sku: int, usage_patterns: np.ndarray,
+                     time_columns: Dict[str, np.ndarray], start_hour: int = 0) -> Dict[str, np.ndarray]:
+        """Build the columns for one (service, option) block as arrays, one row per resource and hour"""
+        num_series, n = usage_patterns.shape
+        rows = num_series * n
+        hour_slice = slice(start_hour, start_hour + n)
+        pricing = self.pricing
+        option_name = pricing.option_names[sku]
+        hourly_rate = pricing.hourly_rates[sku]
+        region_mult = pricing.region_multiplier[pricing.sku_service[sku], self.region_id]
+        rate = pricing.effective_rates[sku, self.region_id]
+        usage = np.round(usage_patterns.ravel(), 6)
+        cost = np.round(usage_patterns.ravel() * hourly_rate * region_mult, 6)
+
+        # Resources are assigned to accounts in blocks and to availability zones round-robin
+        series = np.arange(num_series)
+        accounts = self.account_ids()
+        zones = self.availability_zones()
+        account_codes = series // self.resources_per_option
+        self.summary.add_block(self.selected_region, service_name, pricing.usage_type(sku, self.selected_region),
+                               accounts, account_codes, time_columns['day_labels'],
+                               time_columns['day_code'][hour_slice], cost.reshape(num_series, n),
+                               usage.reshape(num_series, n))
+        # IDs are digests of the config and seed, so the same inputs always produce the same IDs
+        resource_ids = [
+            f"{service_name.lower()}-resource-{_stable_id('resource', self.seed, self.selected_region, service_name, option_name, i)}"
+            for i in series
+        ]
+        line_item_prefix = np.array([
+            f"{_stable_id('lineitem', self.seed, self.selected_region, service_name, option_name, i)}-"
+            for i in series
+        ], dtype=object)
+
+        def constant(value) -> pd.Categorical:
+            return self._categorical(np.zeros(rows, dtype=np.int8), (value,))
+
+        def per_hour(values):
+            if isinstance(values, pd.Categorical):
+                values = values[hour_slice]
+                return pd.Categorical.from_codes(np.tile(values.codes, num_series), dtype=values.dtype, validate=False)
+            return np.tile(values[hour_slice], num_series)
+
+        def per_series(codes: np.ndarray, categories: List[str]) -> pd.Categorical:
+            return self._categorical(np.repeat(codes, n), categories)
+
+        return {
+            'identity/TimeInterval': per_hour(time_columns['identity/TimeInterval']),
+            'identity/LineItemId': np.repeat(line_item_prefix, n) + np.tile(time_columns['epoch_hour'][hour_slice], num_series),
+            'bill/PayerAccountId': constant(accounts[0]),
+            'bill/BillingPeriodStartDate': constant(self.billing_period[0].strftime('%Y-%m-%d')),
+            'bill/BillingPeriodEndDate': constant(self.billing_period[1].strftime('%Y-%m-%d')),
+            'lineItem/UsageAccountId': per_series(account_codes, accounts),
+            'lineItem/ProductCode': constant(service_name),
+            'lineItem/UsageType': constant(pricing.usage_type(sku, self.selected_region)),
+            'lineItem/Operation': constant(pricing.operations[sku]),
+            'lineItem/AvailabilityZone': per_series(series % len(zones), zones),
+            'lineItem/ResourceId': per_series(series, resource_ids),
+            'lineItem/UsageStartDate': per_hour(time_columns['lineItem/UsageStartDate']),
+            'lineItem/UsageEndDate': per_hour(time_columns['lineItem/UsageEndDate']),
+            'lineItem/UsageAmount': usage,
+            'lineItem/NormalizedUsageAmount': usage,
+            'lineItem/UnblendedRate': np.full(rows, round(rate, 6)),
+            'lineItem/UnblendedCost': cost,
+            'lineItem/BlendedRate': np.full(rows, round(rate, 6)),
+            'lineItem/BlendedCost': cost,
+            'lineItem/LineItemDescription': constant(pricing.descriptions[sku]),
+            'product/ProductName': constant(pricing.service_names[pricing.sku_service[sku]]),
+            'product/region': constant(self.selected_region),
+            'pricing/unit': constant(pricing.units[sku]),
+        }
+
+    def _categorical(self, codes: np.ndarray, categories) -> pd.Categorical:
+        key = tuple(categories)
+        if key not in self._dtypes:
+            self._dtypes[key] = pd.CategoricalDtype(list(key))
+        return pd.Categorical.from_codes(codes, dtype=self._dtypes[key], validate=False)
+
+    def _timed_block(self, service_name: str, sku: int, usage_patterns: np.ndarray,
+                     time_columns: Dict[str, np.ndarray], start_hour: int = 0) -> Dict[str, np.ndarray]:
+        with self.profile.stage('build_block') as stage:
+            block = self._build_block(service_name, sku, usage_patterns, time_columns, start_hour)
+            stage.rows = usage_patterns.size
+        return block
+
+    def _iter_blocks(self, chunk_by: str = 'option') -> Iterator[Dict[str, np.ndarray]]:
+        """Yield column blocks one option or one day at a time"""
+        if chunk_by not in ('option', 'day'):
+            raise ValueError(f"Unknown chunk_by: {chunk_by}")
+        hours = self.hours
+        self.summary = CostSummary()
+        active = self._active_options()
+        if not active:
+            return
+        time_columns = self._time_columns(hours)
+        if chunk_by == 'option':
+            for service_name, sku, usage_value in active:
+                usage_patterns = self._option_patterns(service_name, sku, usage_value, 0, hours)
+                yield self._timed_block(service_name, sku, usage_patterns, time_columns)
+            return
+        # Patterns come from per-day streams, so each day is drawn on its own and matches option chunking
+        for start_hour in range(0, hours, 24):
+            n = min(24, hours - start_hour)
+            blocks = []
+            for service_name, sku, usage_value in active:
+                usage_patterns = self._option_patterns(service_name, sku, usage_value, start_hour, n)
+                blocks.append(self._timed_block(service_name, sku, usage_patterns, time_columns, start_hour))
+            with self.profile.stage('concat_blocks') as stage:
+                block = _concat_blocks(blocks, self._dtype_unions)
+                stage.rows = len(block['identity/LineItemId'])
+            yield block
+
+    def iter_chunks(self, chunk_by: str = 'option') -> Iterator[pd.DataFrame]:
+        """Yield billing data as DataFrames, one per service option or one per day"""
+        for block in self._iter_blocks(chunk_by):
+            with self.profile.stage('to_frame') as stage:
+                chunk = pd.DataFrame(block, columns=CUR_COLUMNS)
+                stage.rows = len(chunk)
+            yield chunk
+
+    def generate_data(self, engine: str = 'vectorized') -> pd.DataFrame:
+        """Generate billing data; engine='legacy' runs the original per-hour loop to compare costs"""
+        if engine == 'legacy':
+            return self._generate_data_legacy()
+        if engine != 'vectorized':
+            raise ValueError(f"Unknown engine: {engine}")
+        blocks = list(self._iter_blocks())
+        if not blocks:
+            return pd.DataFrame(columns=CUR_COLUMNS)
+        with self.profile.stage('concat_blocks') as stage:
+            columns = _concat_blocks(blocks, self._dtype_unions)
+            stage.rows = len(columns['identity/LineItemId'])
+        with self.profile.stage('to_frame') as stage:
+            df = pd.DataFrame(columns, columns=CUR_COLUMNS)
+            stage.rows = len(df)
+        return df
+
+    def _generate_data_legacy(self) -> pd.DataFrame:
+        if self.pricing is not default_pricing_index():
+            raise ValueError("The legacy engine only supports the built-in catalog")
         records = []
         hours = self.days * 24
         for service_name, options in self.selected_services.items():
@@ -31,7 +380,9 @@ class BillingDataGenerator:
                 if option.name in options:
                     usage_value = float(options[option.name])
                     if usage_value > 0:
-                        usage_pattern = self.generate_usage_pattern(usage_value, hours)
+                        # The vectorized engine's pattern source, so the two engines can be compared row by row
+                        sku = self.pricing.sku_id(service_name, option.name)
+                        usage_pattern = self._option_patterns(service_name, sku, usage_value, 0, hours)[0]
                         for hour in range(hours):
                             current_time = self.start_date + timedelta(hours=hour)
                             usage = usage_pattern[hour]
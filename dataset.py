@@ -0,0 +1,141 @@
+import copy
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+import pandas as pd
+from data_generator import BillingDataGenerator, concat_chunks
+from pricing import PricingIndex, default_pricing_index
+from summary import CostSummary
+from profiling import RunProfile
+from patterns import PROFILE_SETS
+from incremental import billing_period, load_state
+
+TimeLike = Union[datetime, date, str, pd.Timestamp]
+
+def _to_hour(value: TimeLike, ceil: bool = False) -> datetime:
+    """A time as a naive datetime on an hour boundary, rounded down or up"""
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+    return (timestamp.ceil('h') if ceil else timestamp.floor('h')).to_pydatetime()
+
+def _as_list(values: Optional[Union[str, Iterable[str]]]) -> Optional[List[str]]:
+    if values is None:
+        return None
+    return [values] if isinstance(values, str) else list(values)
+
+class BillingDataset:
+    """A seeded billing dataset held as its config, materialized one (region, service, time range) slice at a time
+
+    Seeded usage and cost are functions of the config, seed and absolute hour, so a slice is generated
+    on its own in time proportional to its size and matches the same rows of the full dataset.
+    Nothing is generated until iter_chunks or to_frame is called.
+    """
+
+    def __init__(self, config: Dict[str, Dict[str, Dict[str, float]]], days: float, seed: int,
+                 end_date: Optional[datetime] = None, num_accounts: int = 1, resources_per_option: int = 1,
+                 pricing: Optional[PricingIndex] = None, patterns: str = 'classic'):
+        if seed is None:
+            raise ValueError("A lazy dataset requires a seed")
+        if patterns not in PROFILE_SETS:
+            raise ValueError(f"Unknown pattern set: {patterns}")
+        self.pricing = pricing or default_pricing_index()
+        self.pricing.validate_config(config)
+        self.config = {region: {name: options for name, options in services.items() if options}
+                       for region, services in config.items()}
+        self.seed = seed
+        self.num_accounts = num_accounts
+        self.resources_per_option = resources_per_option
+        self.patterns = patterns
+        if end_date is None:
+            end_date = datetime.combine(date.today(), datetime.min.time())
+        self.end_date = _to_hour(end_date)
+        self.start_date = self.end_date - timedelta(hours=int(round(days * 24)))
+        # Slices keep the full dataset's billing period and growth origin, so their rows match it exactly
+        self.billing_period = (self.start_date, self.end_date)
+        self.pattern_origin = self.start_date
+
+    @classmethod
+    def from_output(cls, output: str, pricing: Optional[PricingIndex] = None) -> 'BillingDataset':
+        """The dataset of a seeded output, from its saved generator state, without reading the output"""
+        state = load_state(output)
+        pricing = pricing or default_pricing_index()
+        if state['catalog'] != pricing.version:
+            raise ValueError("The pricing catalog changed since this output was generated")
+        if not state.get('pattern_origin'):
+            raise ValueError(f"The state of {output} does not record its start date; regenerate it to query it")
+        start_date = datetime.fromisoformat(state['pattern_origin'])
+        end_date = datetime.fromisoformat(state['end_date'])
+        dataset = cls(state['config'], (end_date - start_date) / timedelta(days=1), state['seed'], end_date,
+                      state['num_accounts'], state['resources_per_option'], pricing, state.get('patterns', 'classic'))
+        # Appended hours carry the billing period the output was first written with
+        dataset.billing_period = billing_period(state) or dataset.billing_period
+        return dataset
+
+    @property
+    def regions(self) -> List[str]:
+        return [region for region, services in self.config.items() if services]
+
+    def services(self, region: str) -> List[str]:
+        return list(self.config.get(region, {}))
+
+    @property
+    def hours(self) -> int:
+        return int((self.end_date - self.start_date) // timedelta(hours=1))
+
+    @property
+    def num_series(self) -> int:
+        return self.num_accounts * self.resources_per_option
+
+    @property
+    def rows(self) -> int:
+        """Line items in the dataset, counted from the config without generating them"""
+        options = sum(1 for services in self.config.values() for options in services.values()
+                      for value in options.values() if value > 0)
+        return options * self.num_series * self.hours
+
+    def slice(self, regions: Optional[Union[str, Iterable[str]]] = None,
+              services: Optional[Union[str, Iterable[str]]] = None,
+              start: Optional[TimeLike] = None, end: Optional[TimeLike] = None) -> 'BillingDataset':
+        """A lazy view of some regions, services and hours of this dataset; times are clipped to its window"""
+        regions, services = _as_list(regions), _as_list(services)
+        for region in regions or []:
+            if region not in self.config:
+                raise ValueError(f"Region not in dataset: {region}")
+        view = copy.copy(self)
+        view.config = {
+            region: {name: options for name, options in region_services.items()
+                     if services is None or name in services}
+            for region, region_services in self.config.items()
+            if regions is None or region in regions
+        }
+        if start is not None:
+            view.start_date = min(max(_to_hour(start), self.start_date), self.end_date)
+        if end is not None:
+            view.end_date = max(min(_to_hour(end, ceil=True), self.end_date), view.start_date)
+        return view
+
+    def _generators(self, profile: Optional[RunProfile] = None) -> Iterator[BillingDataGenerator]:
+        if self.hours <= 0:
+            return
+        for region in self.regions:
+            yield BillingDataGenerator(self.config[region], region, self.hours / 24, self.num_accounts,
+                                       self.resources_per_option, seed=self.seed, end_date=self.end_date,
+                                       pricing=self.pricing, profile=profile,
+                                       usage_profiles=PROFILE_SETS[self.patterns],
+                                       pattern_origin=self.pattern_origin, billing_period=self.billing_period)
+
+    def iter_chunks(self, chunk_by: str = 'day', summary: Optional[CostSummary] = None,
+                    profile: Optional[RunProfile] = None) -> Iterator[pd.DataFrame]:
+        """Generate the view one day (or one option) per region at a time, adding its totals to summary"""
+        for generator in self._generators(profile):
+            yield from generator.iter_chunks(chunk_by)
+            if summary is not None:
+                summary.merge(generator.summary)
+
+    def to_frame(self, summary: Optional[CostSummary] = None, profile: Optional[RunProfile] = None) -> pd.DataFrame:
+        """Materialize the view as one DataFrame"""
+        return concat_chunks(list(self.iter_chunks(summary=summary, profile=profile)))
+
+    def __repr__(self) -> str:
+        return (f"BillingDataset(regions={self.regions}, start={self.start_date.isoformat()}, "
+                f"end={self.end_date.isoformat()}, seed={self.seed}, rows={self.rows})")
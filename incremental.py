@@ -0,0 +1,103 @@
+import json
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, Optional, Tuple
+import pandas as pd
+from data_generator import BillingDataGenerator
+from cur_formatter import CURFormatter
+from pricing import PricingIndex, default_pricing_index
+from patterns import PROFILE_SETS
+
+STATE_FILE = '_synaws_state.json'
+
+def state_path(output: str) -> str:
+    """Where the generator state of an output lives: inside a Parquet or CSV part directory, next to a CSV file"""
+    if os.path.isdir(output):
+        return os.path.join(output, STATE_FILE)
+    return f"{output}.state.json"
+
+def make_state(config: Dict[str, Dict[str, Dict[str, float]]], seed: int, end_date: datetime,
+               output_format: str, compression: str, num_accounts: int = 1, resources_per_option: int = 1,
+               pricing: Optional[PricingIndex] = None, part_rows: Optional[int] = None,
+               patterns: str = 'classic', pattern_origin: Optional[datetime] = None) -> Dict:
+    """Describe a seeded output well enough to continue it later"""
+    return {
+        'config': config,
+        'seed': seed,
+        'end_date': end_date.isoformat(),
+        'output_format': output_format,
+        'compression': compression,
+        'num_accounts': num_accounts,
+        'resources_per_option': resources_per_option,
+        'catalog': (pricing or default_pricing_index()).version,
+        'part_rows': part_rows,
+        'patterns': patterns,
+        'pattern_origin': pattern_origin.isoformat() if pattern_origin else None,
+        # The window the output was first generated for, which appended rows keep reporting
+        'billing_period': [pattern_origin.isoformat(), end_date.isoformat()] if pattern_origin else None,
+    }
+
+def save_state(output: str, state: Dict):
+    with open(state_path(output), 'w') as f:
+        json.dump(state, f, indent=2)
+
+def load_state(output: str) -> Dict:
+    path = state_path(output)
+    if not os.path.exists(path):
+        raise ValueError(f"No generator state found for {output}")
+    with open(path) as f:
+        return json.load(f)
+
+def billing_period(state: Dict) -> Optional[Tuple[datetime, datetime]]:
+    """The billing period of an output's rows, or None for states that do not record its start"""
+    if state.get('billing_period'):
+        start, end = state['billing_period']
+        return datetime.fromisoformat(start), datetime.fromisoformat(end)
+    if state.get('pattern_origin'):
+        # Written before billing periods were saved and not appended to since
+        return datetime.fromisoformat(state['pattern_origin']), datetime.fromisoformat(state['end_date'])
+    return None
+
+def _iter_new_chunks(state: Dict, hours: int, until: datetime, pricing: PricingIndex) -> Iterator[pd.DataFrame]:
+    # States written before pattern sets existed are classic
+    usage_profiles = PROFILE_SETS[state.get('patterns', 'classic')]
+    pattern_origin = datetime.fromisoformat(state['pattern_origin']) if state.get('pattern_origin') else None
+    for region, services in state['config'].items():
+        services = {name: options for name, options in services.items() if options}
+        if not services:
+            continue
+        generator = BillingDataGenerator(services, region, hours / 24, state['num_accounts'],
+                                         state['resources_per_option'], seed=state['seed'],
+                                         end_date=until, pricing=pricing, usage_profiles=usage_profiles,
+                                         pattern_origin=pattern_origin, billing_period=billing_period(state))
+        yield from generator.iter_chunks(chunk_by='day')
+
+def append_missing_hours(output: str, until: Optional[datetime] = None,
+                         pricing: Optional[PricingIndex] = None) -> int:
+    """Generate only the hours between the saved end date and until, append them to output and return rows written"""
+    state = load_state(output)
+    pricing = pricing or default_pricing_index()
+    if state['catalog'] != pricing.version:
+        raise ValueError("The pricing catalog changed since this output was generated")
+    if until is None:
+        until = datetime.combine(date.today(), datetime.min.time())
+    hours = int((until - datetime.fromisoformat(state['end_date'])) // timedelta(hours=1))
+    if hours <= 0:
+        return 0
+    until = datetime.fromisoformat(state['end_date']) + timedelta(hours=hours)
+    # Seeded usage is a function of the seed and absolute hour, so the new hours continue the
+    # daily and weekly cycles exactly as a full regeneration would
+    period = billing_period(state)
+    if period is not None:
+        state['billing_period'] = [value.isoformat() for value in period]
+    chunks = _iter_new_chunks(state, hours, until, pricing)
+    if state['output_format'] == 'parquet':
+        rows = CURFormatter.write_cur_parquet(chunks, output, state['compression'], append=True)
+    elif os.path.isdir(output):
+        rows = CURFormatter.write_cur_csv_parts(chunks, output, state['compression'], state.get('part_rows'),
+                                                append=True)
+    else:
+        rows = CURFormatter.write_cur_csv(chunks, output, append=True)
+    state['end_date'] = until.isoformat()
+    save_state(output, state)
+    return rows
@@ -1,19 +1,59 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import io
 import random
 from services import AWS_SERVICES, AWS_REGIONS
 from data_generator import BillingDataGenerator
 from cur_formatter import CURFormatter
-import base64
-from datetime import datetime
+from summary import CostSummary
+from profiling import RunProfile, CAPTURE_MODES
+from patterns import PROFILE_SETS
+from datetime import date, datetime
+from typing import Dict, Optional, Tuple
 
-def get_download_link(csv_string: str) -> str:
-    """Generate a download link for the CSV file"""
-    b64 = base64.b64encode(csv_string.encode()).decode()
-    date_str = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"aws_billing_data_{date_str}.csv"
-    return f'<a href="data:text/csv;base64,{b64}" download="{filename}">Download CSV file</a>'
+@st.cache_data(show_spinner=False, max_entries=64)
+def generate_region(region: str, services: Dict[str, Dict], days: int, seed: int, end_date: datetime,
+                    capture: Optional[str] = None, patterns: str = 'classic') -> Tuple[bytes, pd.DataFrame, CostSummary, Dict]:
+    """Generate one region as CSV bytes plus a preview, its cost summary and its stage profile; cached per region config"""
+    with RunProfile(capture) as profile:
+        generator = BillingDataGenerator(services, region, days, seed=seed, end_date=end_date, profile=profile,
+                                         usage_profiles=PROFILE_SETS[patterns])
+        preview = []
+
+        def stream_chunks():
+            for chunk in profile.timed('generate', generator.iter_chunks(chunk_by='day')):
+                if not preview:
+                    preview.append(chunk.head())
+                yield chunk
+
+        # CSV text is encoded straight into one bytes buffer instead of being held as a str first
+        buffer = io.BytesIO()
+        with profile.stage('format_csv') as stage:
+            sink = io.TextIOWrapper(buffer, encoding='utf-8', newline='')
+            stage.rows = CURFormatter.write_cur_csv(stream_chunks(), sink)
+            sink.detach()
+    return buffer.getvalue(), preview[0] if preview else pd.DataFrame(), generator.summary, profile.to_dict()
+
+def merge_csv(parts: list) -> bytes:
+    """Join per-region CSV bytes, keeping only the first header"""
+    if len(parts) == 1:
+        return parts[0]
+    return parts[0] + b''.join(part.split(b'\n', 1)[1] for part in parts[1:])
+
+def get_session_random_services(region: str, num_services: int) -> list:
+    """Random service picks for a region, kept stable across Streamlit reruns"""
+    key = f"{region}_random_services_{num_services}"
+    if key not in st.session_state:
+        st.session_state[key] = get_random_services(num_services)
+    return st.session_state[key]
+
+def get_session_random_value(option, key: str) -> float:
+    """Random default for a widget, kept stable across Streamlit reruns"""
+    default_key = f"{key}_random_default"
+    if default_key not in st.session_state:
+        st.session_state[default_key] = float(generate_random_value(option))
+    return st.session_state[default_key]
 
 def get_random_services(num_services: int = 3) -> list:
     """Get a mix of fixed and random services"""
@@ -78,6 +118,14 @@ def main():
     st.sidebar.subheader("1. Global Settings")
     days = st.sidebar.selectbox("Number of days of data to generate", [30, 45, 60, 90])
     num_random_services = st.sidebar.slider("Number of additional random services per region", 1, 5, 3)
+    # A per-session seed keeps generated data reproducible so unchanged regions are served from the cache
+    if 'seed' not in st.session_state:
+        st.session_state['seed'] = random.randrange(2 ** 31)
+    seed = int(st.sidebar.number_input("Random seed", min_value=0, value=st.session_state['seed'], step=1))
+    patterns = st.sidebar.selectbox("Usage patterns", list(PROFILE_SETS),
+                                    help="classic: one daily and weekly cycle; realistic: per-service growth, bursts and month-end spikes")
+    capture = st.sidebar.selectbox("Profiling capture", [None] + CAPTURE_MODES,
+                                   format_func=lambda mode: mode or "timing only")
 
     st.sidebar.subheader("2. Select Regions")
     selected_regions = {}
@@ -108,7 +156,7 @@ def main():
                 st.markdown("Amazon EC2")
                 selected_services['EC2'] = {}
                 for option in AWS_SERVICES['EC2'].options:
-                    default_value = generate_random_value(option) if use_random_required else float(option.min_value)
+                    default_value = get_session_random_value(option, f"{region}_EC2_{option.name}") if use_random_required else float(option.min_value)
                     value = st.number_input(
                         f"EC2 - {option.name} ({option.unit})",
                         min_value=float(option.min_value),
@@ -124,7 +172,7 @@ def main():
                 st.markdown("Amazon S3")
                 selected_services['S3'] = {}
                 for option in AWS_SERVICES['S3'].options:
-                    default_value = generate_random_value(option) if use_random_required else float(option.min_value)
+                    default_value = get_session_random_value(option, f"{region}_S3_{option.name}") if use_random_required else float(option.min_value)
                     value = st.number_input(
                         f"S3 - {option.name} ({option.unit})",
                         min_value=float(option.min_value),
@@ -137,7 +185,7 @@ def main():
                         selected_services['S3'][option.name] = value
 
             st.markdown("Additional Services")
-            random_services = get_random_services(num_random_services)
+            random_services = get_session_random_services(region, num_random_services)
             enabled_services = {}
             for service_name in random_services:
                 enabled_services[service_name] = st.checkbox(f"Enable {service_name}", key=f"{region}_{service_name}_enable")
@@ -154,7 +202,7 @@ def main():
                         cols = st.columns(min(num_options, 2))
                         for idx, option in enumerate(service.options):
                             with cols[idx % 2]:
-                                default_value = float(generate_random_value(option)) if use_random else float(option.min_value)
+                                default_value = get_session_random_value(option, f"{region}_{service_name}_{option.name}") if use_random else float(option.min_value)
                                 value = st.number_input(
                                     f"{option.name} ({option.unit})",
                                     min_value=float(option.min_value),
@@ -172,33 +220,67 @@ def main():
         if not any(selected_services_by_region.values()):
             st.error("Please configure at least one service in any selected region")
             return
+        st.session_state['generated_config'] = (selected_services_by_region, days, seed, capture, patterns)
+
+    if 'generated_config' in st.session_state:
+        services_by_region, generated_days, generated_seed, generated_capture, generated_patterns = st.session_state['generated_config']
+        end_date = datetime.combine(date.today(), datetime.min.time())
+        # The merged download is built once per generated config and reused on later reruns,
+        # e.g. after clicking the download button; changed regions come back from generate_region's cache
+        result_key = (st.session_state['generated_config'], end_date)
+        result = st.session_state.get('generated_result')
+        if result is None or result[0] != result_key:
+            with st.spinner("Generating billing data..."):
+                parts = []
+                previews = []
+                summary = CostSummary()
+                # Region profiles are recorded when a region is generated and come back with cached results
+                profile = RunProfile()
+                progress_bar = st.progress(0)
+                for idx, (region, services) in enumerate(services_by_region.items()):
+                    if services:
+                        csv_bytes, preview, region_summary, region_profile = generate_region(
+                            region, services, generated_days, generated_seed, end_date, generated_capture, generated_patterns)
+                        parts.append(csv_bytes)
+                        previews.append(preview)
+                        summary.merge(region_summary)
+                        profile.merge(RunProfile.from_dict(region_profile))
+                    progress_bar.progress((idx + 1) / len(services_by_region))
+                download = None
+                if parts:
+                    with profile.stage('download_bytes') as stage:
+                        download = merge_csv(parts)
+                        stage.rows = summary.rows
+                    del parts
+            result = (result_key, download, previews, summary, profile)
+            st.session_state['generated_result'] = result
+        _, download, previews, summary, profile = result
 
-        with st.spinner("Generating billing data..."):
-            all_records = []
-            progress_bar = st.progress(0)
-            for idx, (region, services) in enumerate(selected_services_by_region.items()):
-                if services:
-                    generator = BillingDataGenerator(services, region, days)
-                    df = generator.generate_data()
-                    all_records.append(df)
-                progress_bar.progress((idx + 1) / len(selected_services_by_region))
-
-            if all_records:
-                final_df = pd.concat(all_records, ignore_index=True)
-                formatter = CURFormatter()
-                csv_string = formatter.format_cur_csv(final_df)
-                st.markdown(get_download_link(csv_string), unsafe_allow_html=True)
-                st.subheader("Data Preview")
-                st.dataframe(final_df.head())
-                st.subheader("Summary Statistics")
-                total_cost = final_df['lineItem/UnblendedCost'].sum()
-                st.write(f"Total Cost: ${total_cost:,.2f}")
-                region_costs = final_df.groupby('product/region')['lineItem/UnblendedCost'].sum()
-                st.write("Cost by Region:")
-                st.bar_chart(region_costs)
-                service_costs = final_df.groupby('lineItem/ProductCode')['lineItem/UnblendedCost'].sum()
-                st.write("Cost by Service:")
-                st.bar_chart(service_costs)
+        if download is not None:
+            st.download_button(
+                "Download CSV file",
+                data=download,
+                file_name=f"aws_billing_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                mime='text/csv'
+            )
+            st.subheader("Data Preview")
+            st.dataframe(previews[0])
+            st.subheader("Summary Statistics")
+            st.write(f"Total Cost: ${summary.total_cost:,.2f}")
+            st.write("Cost by Region:")
+            st.bar_chart(summary.cost_by('region'))
+            st.write("Cost by Service:")
+            st.bar_chart(summary.cost_by('service'))
+            st.write("Cost by Day:")
+            st.line_chart(summary.cost_by('day'))
+            st.write("Cost by Usage Type:")
+            st.bar_chart(summary.cost_by('usage_type'))
+            with st.expander("Performance profile"):
+                st.dataframe(profile.to_frame())
+                if profile.hotspots:
+                    st.code(profile.hotspots)
+                if profile.allocations:
+                    st.code(profile.allocations)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,194 @@
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+# Day 0 of the epoch (1970-01-01) was a Thursday
+_EPOCH_WEEKDAY = 3
+
+@dataclass
+class PatternContext:
+    """Hourly index and random draws a pattern is built from
+
+    index is datetime64[h]. noise holds one standard normal draw per resource and hour, and
+    day_draws(stream, k) returns k uniform draws per resource and UTC day covered by index,
+    shaped (resources, days, k). Draws are functions of the hour or day, not the window, so
+    any slice of a series can be regenerated on its own.
+    """
+    index: np.ndarray
+    origin: np.datetime64
+    noise: np.ndarray
+    day_draws: Callable[[int, int], np.ndarray]
+
+    @property
+    def num_series(self) -> int:
+        return self.noise.shape[0]
+
+    @cached_property
+    def hour_of_day(self) -> np.ndarray:
+        return self.index.astype(np.int64) % 24
+
+    @cached_property
+    def days(self) -> np.ndarray:
+        """UTC day number since the epoch of each hour"""
+        return self.index.astype('datetime64[D]').astype(np.int64)
+
+    @cached_property
+    def weekday(self) -> np.ndarray:
+        """Day of the week of each hour, Monday = 0"""
+        return (self.days + _EPOCH_WEEKDAY) % 7
+
+    @cached_property
+    def days_to_month_end(self) -> np.ndarray:
+        """Whole days left in the calendar month of each hour, 0 on the last day"""
+        day = self.index.astype('datetime64[D]')
+        next_month = (self.index.astype('datetime64[M]') + 1).astype('datetime64[D]')
+        return (next_month - day).astype(np.int64) - 1
+
+# Components return a multiplicative factor shaped (hours,) or (resources, hours); any callable
+# taking a PatternContext can be used as one
+
+@dataclass(frozen=True)
+class DailyCycle:
+    """Sinusoidal daily cycle peaking at peak_hour UTC"""
+    amplitude: float = 0.2
+    peak_hour: int = 14
+
+    def __call__(self, context: PatternContext) -> np.ndarray:
+        return 1 + self.amplitude * np.cos((context.hour_of_day - self.peak_hour) * 2 * np.pi / 24)
+
+@dataclass(frozen=True)
+class WeeklyCycle:
+    """Lower usage on Saturdays and Sundays of the actual calendar"""
+    weekend_level: float = 0.8
+
+    def __call__(self, context: PatternContext) -> np.ndarray:
+        return np.where(context.weekday >= 5, self.weekend_level, 1.0)
+
+@dataclass(frozen=True)
+class GrowthTrend:
+    """Compound growth of monthly_rate per 30-day month since the pattern origin"""
+    monthly_rate: float = 0.03
+
+    def __call__(self, context: PatternContext) -> np.ndarray:
+        months = (context.index - context.origin).astype(np.int64) / (30 * 24)
+        return (1 + self.monthly_rate) ** months
+
+@dataclass(frozen=True)
+class AutoscalingBursts:
+    """On a share of days each resource scales out by magnitude for duration_hours from a random hour"""
+    daily_probability: float = 0.1
+    magnitude: float = 1.0
+    duration_hours: int = 4
+    stream: int = 1
+
+    def __call__(self, context: PatternContext) -> np.ndarray:
+        draws = context.day_draws(self.stream, 2)
+        position = context.days - context.days[0]
+        burst_day = draws[:, position, 0] < self.daily_probability
+        start = np.floor(draws[:, position, 1] * (25 - self.duration_hours))
+        hour = context.hour_of_day
+        active = burst_day & (hour >= start) & (hour < start + self.duration_hours)
+        return 1 + self.magnitude * active
+
+@dataclass(frozen=True)
+class MonthEndSpike:
+    """Usage raised by magnitude over the last days of each calendar month, e.g. batch reporting"""
+    magnitude: float = 1.0
+    days: int = 3
+
+    def __call__(self, context: PatternContext) -> np.ndarray:
+        return np.where(context.days_to_month_end < self.days, 1 + self.magnitude, 1.0)
+
+@dataclass(frozen=True)
+class StepChange:
+    """Level multiplied by factor from a point in time on, e.g. a migration or a known anomaly"""
+    at: str
+    factor: float
+
+    def __call__(self, context: PatternContext) -> np.ndarray:
+        return np.where(context.index >= np.datetime64(self.at, 'h'), self.factor, 1.0)
+
+@dataclass
+class UsageProfile:
+    """A workload shape: the product of its components applied to the mean, with relative Gaussian noise
+
+    follows maps an option to another option of the same service whose shape, bursts and per-resource
+    scale it shares, so for example Lambda GB-seconds rise and fall with Lambda requests. correlation is
+    how closely a follower's hourly noise tracks its leader's; the rest is the follower's own.
+    """
+    components: List[Callable[[PatternContext], np.ndarray]] = field(default_factory=list)
+    noise: float = 0.1
+    follows: Dict[str, str] = field(default_factory=dict)
+    correlation: float = 0.8
+
+    def patterns(self, mean_value: float, context: PatternContext, scale: Optional[np.ndarray] = None) -> np.ndarray:
+        """Usage per resource and hour, shaped (resources, hours); scale gives each resource its own level"""
+        factor = np.ones((context.num_series, len(context.index)))
+        for component in self.components:
+            factor *= component(context)
+        base = mean_value * (1 + self.noise * context.noise)
+        if scale is not None:
+            base *= scale
+        return np.maximum(base * factor, 0)
+
+DEFAULT_PROFILE = UsageProfile([DailyCycle(0.2), WeeklyCycle(0.85)])
+
+STEADY = UsageProfile([GrowthTrend(0.01)], noise=0.02)
+STORAGE = UsageProfile([GrowthTrend(0.03)], noise=0.005)
+COMPUTE = UsageProfile([DailyCycle(0.2), WeeklyCycle(0.8), AutoscalingBursts(0.1, 1.0, 4), GrowthTrend(0.01)])
+WEB = UsageProfile([DailyCycle(0.35), WeeklyCycle(0.7), AutoscalingBursts(0.05, 2.0, 2), GrowthTrend(0.02)], noise=0.15)
+BATCH = UsageProfile([DailyCycle(0.1, peak_hour=2), MonthEndSpike(1.5, 2)], noise=0.1)
+
+# Options that follow another share one profile object, looked up under either name
+_S3_REQUESTS = UsageProfile(WEB.components, WEB.noise, follows={'PUT Requests': 'GET Requests'})
+_LAMBDA_INVOCATIONS = UsageProfile([DailyCycle(0.4, 15), WeeklyCycle(0.6), AutoscalingBursts(0.2, 2.0, 2)], noise=0.15,
+                                   follows={'Compute (GB-seconds)': 'Requests'})
+_DYNAMODB_CAPACITY = UsageProfile(WEB.components, WEB.noise, follows={'Write Capacity Units': 'Read Capacity Units'})
+_ELB_TRAFFIC = UsageProfile(WEB.components, WEB.noise, follows={'LCU-hours': 'Processed Bytes'})
+_CDN_TRAFFIC = UsageProfile(WEB.components + [MonthEndSpike(0.5, 3)], WEB.noise,
+                            follows={'Requests (HTTPS)': 'Data Transfer Out'})
+
+# Profiles by service code, overridden per option with "service/option" keys
+SERVICE_PROFILES: Dict[str, UsageProfile] = {
+    'EC2': COMPUTE,
+    'EC2/EBS GP2 Storage': STORAGE,
+    'S3': _S3_REQUESTS,
+    'S3/Standard Storage': STORAGE,
+    'S3/Intelligent-Tiering Storage': STORAGE,
+    'RDS': STEADY,
+    'RDS/Storage (GP2)': STORAGE,
+    'RDS/Backup Storage': UsageProfile(STORAGE.components + [MonthEndSpike(0.3, 1)], STORAGE.noise),
+    'Lambda': _LAMBDA_INVOCATIONS,
+    'Lambda/Provisioned Concurrency': STEADY,
+    'CloudWatch': STEADY,
+    'CloudWatch/API Requests': WEB,
+    'CloudWatch/Logs Ingested': BATCH,
+    'DynamoDB': _DYNAMODB_CAPACITY,
+    'DynamoDB/Storage': STORAGE,
+    'DynamoDB/Backup Storage': STORAGE,
+    'ELB': STEADY,
+    'ELB/Processed Bytes': _ELB_TRAFFIC,
+    'ELB/LCU-hours': _ELB_TRAFFIC,
+    'CloudFront': STEADY,
+    'CloudFront/Data Transfer Out': _CDN_TRAFFIC,
+    'CloudFront/Requests (HTTPS)': _CDN_TRAFFIC,
+}
+
+# Named profile sets; 'classic' keeps the generator's original daily and weekly cycle
+PROFILE_SETS: Dict[str, Optional[Dict[str, UsageProfile]]] = {
+    'classic': None,
+    'realistic': SERVICE_PROFILES,
+}
+
+def _lookup(profiles: Dict[str, UsageProfile], service_code: str, option_name: str) -> UsageProfile:
+    return profiles.get(f"{service_code}/{option_name}") or profiles.get(service_code) or DEFAULT_PROFILE
+
+def resolve_profile(profiles: Dict[str, UsageProfile], service_code: str,
+                    option_name: str) -> Tuple[UsageProfile, str, float]:
+    """The profile an option is generated with, the option whose random draws it uses and its noise correlation with it"""
+    profile = _lookup(profiles, service_code, option_name)
+    leader = profile.follows.get(option_name, option_name)
+    if leader == option_name:
+        return profile, option_name, 1.0
+    return _lookup(profiles, service_code, leader), leader, profile.correlation
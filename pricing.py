@@ -0,0 +1,165 @@
+import hashlib
+import json
+import sys
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+from services import AWS_SERVICES, AWS_REGIONS, AWSService, ServiceOption
+
+class PricingIndex:
+    """Service catalog compiled into flat arrays indexed by integer service, SKU and region IDs"""
+
+    def __init__(self, service_codes: List[str], service_names: List[str], regions: List[str],
+                 region_multiplier: np.ndarray, sku_service: np.ndarray, option_names: List[str],
+                 units: List[str], hourly_rates: np.ndarray, min_values: np.ndarray, max_values: np.ndarray):
+        self.service_codes = service_codes
+        self.service_names = service_names
+        self.regions = regions
+        self.region_multiplier = np.asarray(region_multiplier, dtype=float)
+        self.sku_service = np.asarray(sku_service, dtype=np.int64)
+        self.option_names = [sys.intern(name) for name in option_names]
+        self.units = [sys.intern(unit) for unit in units]
+        self.hourly_rates = np.asarray(hourly_rates, dtype=float)
+        self.min_values = np.asarray(min_values, dtype=float)
+        self.max_values = np.asarray(max_values, dtype=float)
+        self._service_ids = {code: i for i, code in enumerate(service_codes)}
+        self._region_ids = {region: i for i, region in enumerate(regions)}
+        self._sku_ids = {(service_codes[s], name): k for k, (s, name) in enumerate(zip(self.sku_service, self.option_names))}
+        if len(self._sku_ids) != len(self.option_names):
+            # A repeated option would be generated once per row, with duplicate line item IDs
+            counts = Counter(zip(self.sku_service.tolist(), self.option_names))
+            duplicates = [f"{service_codes[s]}/{name}" for (s, name), count in counts.items() if count > 1]
+            raise ValueError(f"Duplicate options in catalog: {', '.join(duplicates)}")
+        # Labels that do not depend on the region are built once per SKU
+        self.operations = [
+            sys.intern(f"Use{service_codes[s]}{name.replace(' ', '')}") for s, name in zip(self.sku_service, self.option_names)
+        ]
+        self.descriptions = [
+            sys.intern(f"{service_names[s]} {name} usage") for s, name in zip(self.sku_service, self.option_names)
+        ]
+        # Effective rate of every SKU in every region, shape (skus, regions)
+        self.effective_rates = self.hourly_rates[:, None] * self.region_multiplier[self.sku_service]
+
+    def service_id(self, service_code: str) -> int:
+        if service_code not in self._service_ids:
+            raise ValueError(f"Unknown service: {service_code}")
+        return self._service_ids[service_code]
+
+    def region_id(self, region: str) -> int:
+        if region not in self._region_ids:
+            raise ValueError(f"Unknown region: {region}")
+        return self._region_ids[region]
+
+    def sku_id(self, service_code: str, option_name: str) -> int:
+        if (service_code, option_name) not in self._sku_ids:
+            raise ValueError(f"Unknown option for {service_code}: {option_name}")
+        return self._sku_ids[(service_code, option_name)]
+
+    def validate_config(self, config: Dict[str, Dict[str, Dict[str, float]]]):
+        """Check that every region, service and option of a region -> service -> option config is in the catalog"""
+        for region, services in config.items():
+            self.region_id(region)
+            for service_code, options in services.items():
+                for option_name in options:
+                    self.sku_id(service_code, option_name)
+
+    def service_skus(self, service_code: str) -> np.ndarray:
+        """SKU IDs of a service in catalog order"""
+        return np.flatnonzero(self.sku_service == self.service_id(service_code))
+
+    def usage_type(self, sku_id: int, region: str) -> str:
+        return f"{region}:{self.option_names[sku_id]}"
+
+    @property
+    def version(self) -> str:
+        """Digest of the catalog contents, used to key cached results"""
+        digest = hashlib.sha256()
+        digest.update(json.dumps([self.service_codes, self.service_names, self.regions,
+                                  self.option_names, self.units]).encode())
+        for array in (self.region_multiplier, self.sku_service, self.hourly_rates, self.min_values, self.max_values):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()[:16]
+
+    @classmethod
+    def from_services(cls, services: Dict[str, AWSService], regions: List[str]) -> 'PricingIndex':
+        """Compile a dict of AWSService definitions such as AWS_SERVICES"""
+        codes = list(services)
+        options = [(s, option) for s, code in enumerate(codes) for option in services[code].options]
+        return cls(
+            service_codes=codes,
+            service_names=[services[code].name for code in codes],
+            regions=list(regions),
+            region_multiplier=np.array([[services[code].region_multiplier.get(region, 1.0) for region in regions] for code in codes]),
+            sku_service=np.array([s for s, _ in options], dtype=np.int64),
+            option_names=[option.name for _, option in options],
+            units=[option.unit for _, option in options],
+            hourly_rates=np.array([option.hourly_rate for _, option in options]),
+            min_values=np.array([option.min_value for _, option in options]),
+            max_values=np.array([option.max_value for _, option in options]),
+        )
+
+    @classmethod
+    def from_json(cls, path: str) -> 'PricingIndex':
+        """Load a catalog from JSON with "regions" and "services" keys, services shaped like AWS_SERVICES"""
+        with open(path) as f:
+            catalog = json.load(f)
+        services = {
+            code: AWSService(
+                name=service['name'],
+                options=[ServiceOption(**option) for option in service['options']],
+                region_multiplier=service['region_multiplier'],
+            )
+            for code, service in catalog['services'].items()
+        }
+        return cls.from_services(services, catalog.get('regions', AWS_REGIONS))
+
+    @classmethod
+    def from_csv(cls, path: str) -> 'PricingIndex':
+        """Load a catalog from CSV with one row per SKU
+
+        Columns are service, service_name, option, unit, hourly_rate, min_value, max_value and one
+        column per region holding that service's region multiplier.
+        """
+        df = pd.read_csv(path)
+        base_columns = ['service', 'service_name', 'option', 'unit', 'hourly_rate', 'min_value', 'max_value']
+        missing = [column for column in base_columns if column not in df.columns]
+        if missing:
+            raise ValueError(f"Price file is missing columns: {', '.join(missing)}")
+        regions = [column for column in df.columns if column not in base_columns]
+        # Service-level fields are repeated on every row of a service and must agree
+        varying = df.groupby('service', sort=False)[['service_name'] + regions].nunique(dropna=False)
+        inconsistent = varying[(varying > 1).any(axis=1)]
+        if len(inconsistent):
+            details = [f"{code} ({', '.join(inconsistent.columns[row > 1])})" for code, row in inconsistent.iterrows()]
+            raise ValueError(f"Price file has conflicting service values: {'; '.join(details)}")
+        first_rows = df.groupby('service', sort=False).head(1).set_index('service')
+        codes = list(first_rows.index)
+        sku_service = df['service'].map({code: i for i, code in enumerate(codes)}).to_numpy()
+        return cls(
+            service_codes=codes,
+            service_names=first_rows['service_name'].tolist(),
+            regions=regions,
+            region_multiplier=first_rows[regions].to_numpy(dtype=float),
+            sku_service=sku_service,
+            option_names=df['option'].tolist(),
+            units=df['unit'].tolist(),
+            hourly_rates=df['hourly_rate'].to_numpy(dtype=float),
+            min_values=df['min_value'].to_numpy(dtype=float),
+            max_values=df['max_value'].to_numpy(dtype=float),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> 'PricingIndex':
+        """Load a catalog from a .json or .csv price file"""
+        if path.endswith('.json'):
+            return cls.from_json(path)
+        if path.endswith('.csv'):
+            return cls.from_csv(path)
+        raise ValueError(f"Unsupported price file: {path}")
+
+@lru_cache(maxsize=1)
+def default_pricing_index() -> PricingIndex:
+    """The built-in AWS_SERVICES catalog, compiled on first use"""
+    return PricingIndex.from_services(AWS_SERVICES, AWS_REGIONS)
@@ -0,0 +1,202 @@
+import cProfile
+import io
+import os
+import pstats
+import time
+import tracemalloc
+from typing import Dict, Iterable, Iterator, List, Optional
+import pandas as pd
+
+CAPTURE_MODES = ['cprofile', 'tracemalloc']
+
+STAGE_FIELDS = ['calls', 'seconds', 'self_seconds', 'rows', 'memory_delta_mb']
+
+def _rss_bytes() -> Optional[int]:
+    """Current resident set size, or None where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class _Stage:
+    """One timed entry of a stage; the caller sets rows to what it produced"""
+    __slots__ = ('profile', 'name', 'rows', 'child_seconds', '_start', '_memory')
+
+    def __init__(self, profile: 'RunProfile', name: str):
+        self.profile = profile
+        self.name = name
+        self.rows = 0
+        self.child_seconds = 0.0
+
+    def __enter__(self) -> '_Stage':
+        self._memory = self.profile._memory()
+        self.profile._push(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self._start
+        self.profile._pop(self, seconds)
+        memory = self.profile._memory()
+        delta = (memory - self._memory) / (1024 * 1024) if memory is not None and self._memory is not None else 0.0
+        self.profile._record(self.name, seconds, seconds - self.child_seconds, self.rows, delta)
+
+class _NullStage:
+    """Stage entry of a disabled profile; rows written to it are dropped"""
+    __slots__ = ()
+    rows = property(lambda self: 0, lambda self, value: None)
+
+    def __enter__(self) -> '_NullStage':
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+class RunProfile:
+    """Wall time, rows and memory delta per pipeline stage, with optional cProfile or tracemalloc capture
+
+    Stages nest: seconds includes time spent in stages entered inside it and self_seconds excludes it.
+    Memory deltas come from tracemalloc when capturing with it and from the process RSS otherwise.
+    Profiles from worker processes are folded in with merge, so their seconds add up CPU time, not wall time.
+    """
+
+    def __init__(self, capture: Optional[str] = None, enabled: bool = True):
+        if capture is not None and capture not in CAPTURE_MODES:
+            raise ValueError(f"Unknown capture mode: {capture}")
+        self.enabled = enabled
+        self.capture = capture if enabled else None
+        self.hotspots = ''
+        self.allocations = ''
+        self.peak_traced_mb = 0.0
+        self._stages: Dict[str, Dict[str, float]] = {}
+        self._stack: List[_Stage] = []
+        self._snapshot = None
+        self._snapshot_bytes = 0
+        self._profiler = cProfile.Profile() if self.capture == 'cprofile' else None
+        self._started_tracemalloc = self.capture == 'tracemalloc' and not tracemalloc.is_tracing()
+        if self._started_tracemalloc:
+            tracemalloc.start()
+
+    def __enter__(self) -> 'RunProfile':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stage(self, name: str):
+        """Context manager timing one entry of a stage"""
+        return _Stage(self, name) if self.enabled else _NULL_STAGE
+
+    def timed(self, name: str, chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        """Yield from chunks, timing each step as an entry of stage name and counting its rows"""
+        if not self.enabled:
+            yield from chunks
+            return
+        iterator = iter(chunks)
+        while True:
+            with self.stage(name) as stage:
+                chunk = next(iterator, None)
+                if chunk is None:
+                    return
+                stage.rows = len(chunk)
+            yield chunk
+
+    def _memory(self) -> Optional[int]:
+        if self.capture == 'tracemalloc':
+            return tracemalloc.get_traced_memory()[0]
+        return _rss_bytes()
+
+    def _push(self, stage: _Stage):
+        # cProfile runs only while a top-level stage is open, so idle time between stages is left out
+        if not self._stack and self._profiler is not None:
+            self._profiler.enable()
+        self._stack.append(stage)
+
+    def _pop(self, stage: _Stage, seconds: float):
+        self._stack.remove(stage)
+        if self._stack:
+            self._stack[-1].child_seconds += seconds
+            return
+        if self._profiler is not None:
+            self._profiler.disable()
+        if self.capture == 'tracemalloc':
+            # Keep the allocation sites from whichever top-level stage ended with the most memory live
+            traced = tracemalloc.get_traced_memory()[0]
+            if traced >= self._snapshot_bytes:
+                self._snapshot, self._snapshot_bytes = tracemalloc.take_snapshot(), traced
+
+    def _record(self, name: str, seconds: float, self_seconds: float, rows: int, memory_delta_mb: float):
+        stats = self._stages.setdefault(name, dict.fromkeys(STAGE_FIELDS, 0))
+        stats['calls'] += 1
+        stats['seconds'] += seconds
+        stats['self_seconds'] += self_seconds
+        stats['rows'] += rows
+        stats['memory_delta_mb'] += memory_delta_mb
+
+    def stop(self, limit: int = 25):
+        """End capture and keep the top cProfile functions or tracemalloc allocation sites as text"""
+        if self._profiler is not None:
+            self._profiler.disable()
+            output = io.StringIO()
+            pstats.Stats(self._profiler, stream=output).sort_stats('cumulative').print_stats(limit)
+            self.hotspots = output.getvalue()
+            self._profiler = None
+        if self.capture == 'tracemalloc' and tracemalloc.is_tracing():
+            self.peak_traced_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            statistics = (self._snapshot or tracemalloc.take_snapshot()).statistics('lineno')[:limit]
+            self._snapshot = None
+            self.allocations = '\n'.join(str(statistic) for statistic in statistics)
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+
+    def merge(self, other: 'RunProfile') -> 'RunProfile':
+        """Fold another profile into this one, e.g. from a worker process"""
+        for name, other_stats in other._stages.items():
+            stats = self._stages.setdefault(name, dict.fromkeys(STAGE_FIELDS, 0))
+            for field in STAGE_FIELDS:
+                stats[field] += other_stats[field]
+        self.hotspots = '\n'.join(text for text in (self.hotspots, other.hotspots) if text)
+        self.allocations = '\n'.join(text for text in (self.allocations, other.allocations) if text)
+        self.peak_traced_mb = max(self.peak_traced_mb, other.peak_traced_mb)
+        return self
+
+    def to_frame(self) -> pd.DataFrame:
+        """One row per stage in the order stages were first recorded, with rows per second"""
+        frame = pd.DataFrame.from_dict(self._stages, orient='index', columns=STAGE_FIELDS)
+        frame['rows_per_sec'] = (frame['rows'] / frame['seconds']).where(frame['rows'] > 0, 0.0)
+        frame.index.name = 'stage'
+        return frame
+
+    def report(self) -> str:
+        """The stage table followed by any captured hotspots or allocation sites"""
+        if not self._stages:
+            return "No stages recorded"
+        sections = [self.to_frame().to_string(float_format=lambda value: f"{value:,.3f}")]
+        if self.peak_traced_mb:
+            sections.append(f"Peak traced memory: {self.peak_traced_mb:,.1f} MB")
+        if self.hotspots:
+            sections.append(self.hotspots)
+        if self.allocations:
+            sections.append(self.allocations)
+        return '\n\n'.join(sections)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'RunProfile':
+        profile = cls()
+        profile._stages = {name: dict(stats) for name, stats in data['stages'].items()}
+        profile.hotspots = data.get('hotspots', '')
+        profile.allocations = data.get('allocations', '')
+        profile.peak_traced_mb = data.get('peak_traced_mb', 0.0)
+        return profile
+
+    def to_dict(self) -> Dict:
+        return {
+            'stages': {name: dict(stats) for name, stats in self._stages.items()},
+            'hotspots': self.hotspots,
+            'allocations': self.allocations,
+            'peak_traced_mb': self.peak_traced_mb,
+        }
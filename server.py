@@ -0,0 +1,402 @@
+import argparse
+import json
+import math
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+from cache import ResultCache
+from pricing import PricingIndex, default_pricing_index
+from summary import CostSummary
+from patterns import PROFILE_SETS
+from synaws import generate_to_file
+from cur_formatter import CSV_COMPRESSIONS, PARQUET_COMPRESSIONS
+
+MAX_BODY_BYTES = 1 << 20
+STREAM_CHUNK_BYTES = 1 << 16
+
+# Request limits, so one request cannot exhaust a pool worker's memory or the job directory's disk
+MAX_DAYS = 3660
+MAX_ACCOUNTS = 1000
+MAX_RESOURCES = 1000
+# Jobs are generated one day at a time, so memory follows the rows of a day and disk the rows of the job
+MAX_DAY_ROWS = 2_000_000
+MAX_ROWS = 100_000_000
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue already holds max_pending unfinished jobs"""
+
+def _int_field(body: Dict, name: str, default: Optional[int]) -> Optional[int]:
+    value = body.get(name, default)
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, str):
+        try:
+            value = int(value)
+        except ValueError:
+            pass
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"{name} must be an integer")
+    return value
+
+def _str_field(body: Dict, name: str, default: Optional[str]) -> Optional[str]:
+    value = body.get(name, default)
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"{name} must be a string")
+    return value
+
+def _check_config(config: Dict):
+    """Check the region -> service -> option -> value shape the generator expects"""
+    for services in config.values():
+        if not isinstance(services, dict) or not all(isinstance(options, dict) for options in services.values()):
+            raise ValueError("config must map regions to services to options")
+        for options in services.values():
+            if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in options.values()):
+                raise ValueError("config option values must be numbers")
+
+def parse_request(body: Dict, pricing: PricingIndex) -> Dict:
+    """Validate a job request and fill in defaults; the keys follow the synaws command line options"""
+    if not isinstance(body, dict) or not isinstance(body.get('config'), dict):
+        raise ValueError("Request must be a JSON object with a region -> service -> option 'config'")
+    unknown = set(body) - {'config', 'days', 'seed', 'format', 'compression', 'part_rows',
+                           'accounts', 'resources', 'patterns'}
+    if unknown:
+        raise ValueError(f"Unknown request fields: {', '.join(sorted(unknown))}")
+    request = {
+        'config': body['config'],
+        'days': _int_field(body, 'days', 30),
+        'seed': _int_field(body, 'seed', None),
+        'format': _str_field(body, 'format', 'csv'),
+        'compression': _str_field(body, 'compression', None),
+        'part_rows': _int_field(body, 'part_rows', None),
+        'accounts': _int_field(body, 'accounts', 1),
+        'resources': _int_field(body, 'resources', 1),
+        'patterns': _str_field(body, 'patterns', 'classic'),
+    }
+    if request['days'] is None or request['accounts'] is None or request['resources'] is None:
+        raise ValueError("days, accounts and resources must be integers")
+    if request['days'] < 1 or request['accounts'] < 1 or request['resources'] < 1:
+        raise ValueError("days, accounts and resources must be at least 1")
+    if request['days'] > MAX_DAYS or request['accounts'] > MAX_ACCOUNTS or request['resources'] > MAX_RESOURCES:
+        raise ValueError(f"days, accounts and resources are limited to {MAX_DAYS}, {MAX_ACCOUNTS} "
+                         f"and {MAX_RESOURCES}")
+    if request['seed'] is not None and request['seed'] < 0:
+        raise ValueError("seed must not be negative")
+    if request['part_rows'] is not None and request['part_rows'] < 1:
+        raise ValueError("part_rows must be at least 1")
+    codecs = {'csv': CSV_COMPRESSIONS, 'parquet': PARQUET_COMPRESSIONS}.get(request['format'])
+    if codecs is None:
+        raise ValueError(f"Unknown output format: {request['format']}")
+    if request['compression'] is not None and request['compression'] not in codecs:
+        raise ValueError(f"Unknown compression for {request['format']}: {request['compression']}")
+    if request['patterns'] not in PROFILE_SETS:
+        raise ValueError(f"Unknown pattern set: {request['patterns']}")
+    _check_config(request['config'])
+    pricing.validate_config(request['config'])
+    options = sum(1 for services in request['config'].values() for options in services.values()
+                  for value in options.values() if value > 0)
+    day_rows = options * request['accounts'] * request['resources'] * 24
+    if day_rows > MAX_DAY_ROWS or day_rows * request['days'] > MAX_ROWS:
+        raise ValueError(f"The request would generate {day_rows:,} rows a day and {day_rows * request['days']:,} "
+                         f"in total; the limits are {MAX_DAY_ROWS:,} and {MAX_ROWS:,}")
+    return request
+
+def _output_name(request: Dict) -> str:
+    """A single CSV file, or a directory for CSV parts and Parquet, as synaws writes them"""
+    if request['format'] == 'csv' and request['compression'] in (None, 'none') and not request['part_rows']:
+        return 'billing.csv'
+    return 'billing'
+
+def _run_job(request: Dict, output: str, cache_dir: Optional[str], pricing: PricingIndex) -> Tuple[int, Dict]:
+    """Generate one job's output in a pool process and return its row count and cost summary"""
+    summary = CostSummary()
+    rows = generate_to_file(request['config'], request['days'], output, workers=1,
+                            output_format=request['format'], compression=request['compression'],
+                            num_accounts=request['accounts'], resources_per_option=request['resources'],
+                            seed=request['seed'], cache_dir=cache_dir if request['seed'] is not None else None,
+                            pricing=pricing, summary=summary, part_rows=request['part_rows'],
+                            patterns=request['patterns'])
+    return rows, summary.to_dict()
+
+class Job:
+    """One generation request and, once it finishes, where its output is"""
+
+    def __init__(self, job_id: str, key: str, request: Dict, directory: str, future: Future):
+        self.id = job_id
+        self.key = key
+        self.request = request
+        self.directory = directory
+        self.future = future
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.rows: Optional[int] = None
+        self.summary: Optional[CostSummary] = None
+        self.error: Optional[str] = None
+        self.done = threading.Event()
+
+    @property
+    def status(self) -> str:
+        if self.finished is not None:
+            return 'failed' if self.error else 'done'
+        return 'running' if self.future.running() else 'queued'
+
+    @property
+    def output(self) -> str:
+        """The CSV file, or CSV part or Parquet directory, the job writes"""
+        return os.path.join(self.directory, _output_name(self.request))
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id,
+            'status': self.status,
+            'request': self.request,
+            'created': self.created,
+            'finished': self.finished,
+            'rows': self.rows,
+            'total_cost': self.summary.total_cost if self.summary else None,
+            'error': self.error,
+        }
+
+class JobQueue:
+    """Generation jobs run on a bounded process pool, with identical requests sharing one job
+
+    Seeded requests produce the same output every time, so they share a job for as long as it is kept.
+    Unseeded ones share a job only while it is queued or running.
+    Once more than max_jobs jobs are kept, the oldest finished jobs and their outputs are removed.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_workers: Optional[int] = None, max_pending: int = 64,
+                 max_jobs: int = 256, cache_dir: Optional[str] = None, pricing: Optional[PricingIndex] = None):
+        self.directory = directory or tempfile.mkdtemp(prefix='synaws-jobs-')
+        os.makedirs(self.directory, exist_ok=True)
+        self.max_pending = max_pending
+        self.max_jobs = max_jobs
+        self.cache_dir = cache_dir
+        self.pricing = pricing or default_pricing_index()
+        self.max_workers = max_workers
+        self._executor = self._new_executor()
+        self._lock = threading.Lock()
+        self._jobs: 'OrderedDict[str, Job]' = OrderedDict()
+        self._by_key: Dict[str, str] = {}
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # Spawned workers do not inherit the server's threads or locks
+        return ProcessPoolExecutor(self.max_workers, mp_context=get_context('spawn'))
+
+    def submit(self, body: Dict) -> Tuple[Job, bool]:
+        """Queue a job for a request body, or return the job already running it; the flag is True for a new job"""
+        request = parse_request(body, self.pricing)
+        # Seeded runs end at midnight today, so a finished job is only reused on the day it covers
+        end_date = datetime.combine(date.today(), datetime.min.time()).isoformat()
+        key = ResultCache.make_key(request['config'], request['days'], request['seed'], catalog=self.pricing.version,
+                                   end_date=end_date, **{name: value for name, value in request.items()
+                                                         if name not in ('config', 'days', 'seed')})
+        with self._lock:
+            existing = self._jobs.get(self._by_key.get(key))
+            if existing is not None and (existing.finished is None or
+                                         (existing.status == 'done' and request['seed'] is not None)):
+                return existing, False
+            if self.pending >= self.max_pending:
+                raise QueueFull(f"{self.pending} jobs are already queued or running")
+            job_id = uuid.uuid4().hex
+            directory = os.path.join(self.directory, job_id)
+            os.makedirs(directory)
+            args = (request, os.path.join(directory, _output_name(request)), self.cache_dir, self.pricing)
+            try:
+                future = self._executor.submit(_run_job, *args)
+            except BrokenProcessPool:
+                # A worker died, e.g. killed for memory, which fails its jobs and the pool; later jobs get a new pool
+                self._executor.shutdown(wait=False)
+                self._executor = self._new_executor()
+                future = self._executor.submit(_run_job, *args)
+            job = Job(job_id, key, request, directory, future)
+            self._jobs[job_id] = job
+            self._by_key[key] = job_id
+            self._evict()
+        future.add_done_callback(lambda done: self._finish(job, done))
+        return job, True
+
+    def _finish(self, job: Job, future: Future):
+        try:
+            rows, summary = future.result()
+            job.rows, job.summary = rows, CostSummary.from_dict(summary)
+        except Exception as error:
+            job.error = f"{type(error).__name__}: {error}"
+        job.finished = time.time()
+        job.done.set()
+
+    def _evict(self):
+        finished = [job for job in self._jobs.values() if job.finished is not None]
+        for job in finished[:max(len(self._jobs) - self.max_jobs, 0)]:
+            del self._jobs[job.id]
+            if self._by_key.get(job.key) == job.id:
+                del self._by_key[job.key]
+            shutil.rmtree(job.directory, ignore_errors=True)
+
+    @property
+    def pending(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.finished is None)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+class _ChunkedWriter:
+    """File-like writer sending HTTP/1.1 chunked transfer encoding"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, data: bytes) -> int:
+        if data:
+            self.stream.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        return len(data)
+
+    def close(self):
+        self.stream.write(b"0\r\n\r\n")
+
+class GenerationHandler(BaseHTTPRequestHandler):
+    """JSON API: POST /jobs, GET /jobs, GET /jobs/<id> and GET /jobs/<id>/result"""
+    protocol_version = 'HTTP/1.1'
+    server: 'GenerationServer'
+
+    def _send_json(self, status: int, payload, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self) -> Tuple[List[str], Dict[str, List[str]]]:
+        url = urlsplit(self.path)
+        return [part for part in url.path.split('/') if part], parse_qs(url.query)
+
+    def do_POST(self):
+        parts, _ = self._route()
+        if parts != ['jobs']:
+            return self._send_json(404, {'error': f"Not found: {self.path}"})
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            return self._send_json(400, {'error': "Content-Length must be a non-negative integer"})
+        if length > MAX_BODY_BYTES:
+            return self._send_json(413, {'error': "Request body too large"})
+        try:
+            job, created = self.server.queue.submit(json.loads(self.rfile.read(length) or b'null'))
+        except QueueFull as error:
+            return self._send_json(503, {'error': str(error)}, {'Retry-After': '5'})
+        except ValueError as error:
+            return self._send_json(400, {'error': str(error)})
+        self._send_json(202 if created else 200, job.to_dict(), {'Location': f"/jobs/{job.id}"})
+
+    def do_GET(self):
+        parts, query = self._route()
+        if parts == ['jobs']:
+            return self._send_json(200, [job.to_dict() for job in self.server.queue.jobs()])
+        if len(parts) not in (2, 3) or parts[0] != 'jobs' or (len(parts) == 3 and parts[2] != 'result'):
+            return self._send_json(404, {'error': f"Not found: {self.path}"})
+        job = self.server.queue.get(parts[1])
+        if job is None:
+            return self._send_json(404, {'error': f"Unknown job: {parts[1]}"})
+        if len(parts) == 2:
+            return self._send_json(200, job.to_dict())
+        # Results wait for the job unless ?wait=0, or up to ?timeout= seconds
+        if query.get('wait', ['1'])[0] != '0':
+            try:
+                timeout = float(query['timeout'][0]) if 'timeout' in query else None
+            except ValueError:
+                timeout = math.nan
+            if timeout is not None and not (math.isfinite(timeout) and timeout >= 0):
+                return self._send_json(400, {'error': f"timeout must be a number of seconds: {query['timeout'][0]}"})
+            job.done.wait(timeout)
+        if job.status == 'failed':
+            return self._send_json(500, job.to_dict())
+        if job.status != 'done':
+            return self._send_json(202, job.to_dict(), {'Retry-After': '1'})
+        self._stream_result(job)
+
+    def _stream_result(self, job: Job):
+        output = job.output
+        is_file = os.path.isfile(output)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv' if is_file else 'application/x-tar')
+        self.send_header('Content-Disposition',
+                         f'attachment; filename="{job.id}.csv"' if is_file else f'attachment; filename="{job.id}.tar"')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        writer = _ChunkedWriter(self.wfile)
+        if is_file:
+            with open(output, 'rb') as f:
+                for block in iter(lambda: f.read(STREAM_CHUNK_BYTES), b''):
+                    writer.write(block)
+        else:
+            # CSV part and Parquet directories are streamed as a tar of their files
+            with tarfile.open(fileobj=writer, mode='w|', bufsize=STREAM_CHUNK_BYTES) as archive:
+                archive.add(output, arcname=job.id)
+        writer.close()
+
+    def log_message(self, format: str, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+class GenerationServer(ThreadingHTTPServer):
+    """HTTP server handing generation requests to a JobQueue"""
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], queue: JobQueue, quiet: bool = False):
+        super().__init__(address, GenerationHandler)
+        self.queue = queue
+        self.quiet = quiet
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Serve synthetic AWS billing data generation over HTTP")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on")
+    parser.add_argument('--port', type=int, default=8080, help="Port to listen on")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="Jobs generated at once (default: all cores)")
+    parser.add_argument('--max-pending', type=int, default=64, help="Queued and running jobs before new ones are refused")
+    parser.add_argument('--max-jobs', type=int, default=256, help="Jobs kept, with their outputs, before the oldest are removed")
+    parser.add_argument('--jobs-dir', default=None, help="Directory for job outputs (default: a temporary directory)")
+    parser.add_argument('--cache-dir', default=None, help="Reuse seeded results across restarts from this directory")
+    parser.add_argument('--catalog', default=None, help="JSON or CSV price file to use instead of the built-in catalog")
+    parser.add_argument('--quiet', action='store_true', help="Do not log requests")
+    args = parser.parse_args(argv)
+
+    pricing = PricingIndex.load(args.catalog) if args.catalog else None
+    queue = JobQueue(args.jobs_dir, args.workers, args.max_pending, args.max_jobs, args.cache_dir, pricing)
+    server = GenerationServer((args.host, args.port), queue, args.quiet)
+    print(f"Serving on http://{args.host}:{server.server_address[1]} with job outputs in {queue.directory}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        queue.shutdown()
+
+if __name__ == "__main__":
+    main()
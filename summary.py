@@ -0,0 +1,87 @@
+from collections import defaultdict
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+
+# Rollup dimensions and the CUR column each one groups by
+DIMENSIONS = {
+    'region': 'product/region',
+    'service': 'lineItem/ProductCode',
+    'day': 'lineItem/UsageStartDate',
+    'usage_type': 'lineItem/UsageType',
+    'account': 'lineItem/UsageAccountId',
+}
+
+class CostSummary:
+    """Running totals and per-dimension cost and usage rollups, updated as chunks are produced"""
+
+    def __init__(self):
+        self.rows = 0
+        self.total_cost = 0.0
+        self.total_usage = 0.0
+        self._cost = {dimension: defaultdict(float) for dimension in DIMENSIONS}
+        self._usage = {dimension: defaultdict(float) for dimension in DIMENSIONS}
+
+    def _add(self, dimension: str, key: str, cost: float, usage: float):
+        self._cost[dimension][key] += cost
+        self._usage[dimension][key] += usage
+
+    def add_block(self, region: str, service: str, usage_type: str, accounts: List[str],
+                  account_codes: np.ndarray, day_labels: List[str], day_codes: np.ndarray,
+                  cost: np.ndarray, usage: np.ndarray):
+        """Add one generated block from its (resources, hours) cost and usage arrays without building rows"""
+        block_cost = float(cost.sum())
+        block_usage = float(usage.sum())
+        self.rows += cost.size
+        self.total_cost += block_cost
+        self.total_usage += block_usage
+        self._add('region', region, block_cost, block_usage)
+        self._add('service', service, block_cost, block_usage)
+        self._add('usage_type', usage_type, block_cost, block_usage)
+        account_cost = np.bincount(account_codes, weights=cost.sum(axis=1), minlength=len(accounts))
+        account_usage = np.bincount(account_codes, weights=usage.sum(axis=1), minlength=len(accounts))
+        for code in np.flatnonzero(account_cost + account_usage):
+            self._add('account', accounts[code], float(account_cost[code]), float(account_usage[code]))
+        days, inverse = np.unique(day_codes, return_inverse=True)
+        day_cost = np.bincount(inverse, weights=cost.sum(axis=0))
+        day_usage = np.bincount(inverse, weights=usage.sum(axis=0))
+        for i, code in enumerate(days):
+            self._add('day', day_labels[code], float(day_cost[i]), float(day_usage[i]))
+
+    def merge(self, other: 'CostSummary') -> 'CostSummary':
+        """Fold another summary into this one, e.g. from another region or worker process"""
+        self.rows += other.rows
+        self.total_cost += other.total_cost
+        self.total_usage += other.total_usage
+        for dimension in DIMENSIONS:
+            for key, cost in other._cost[dimension].items():
+                self._add(dimension, key, cost, other._usage[dimension][key])
+        return self
+
+    def cost_by(self, dimension: str) -> pd.Series:
+        """Cost per key of a dimension: region, service, day, usage_type or account"""
+        return pd.Series(dict(self._cost[dimension]), dtype=float).sort_index()
+
+    def usage_by(self, dimension: str) -> pd.Series:
+        """Usage amount per key of a dimension"""
+        return pd.Series(dict(self._usage[dimension]), dtype=float).sort_index()
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'CostSummary':
+        summary = cls()
+        summary.rows = data['rows']
+        summary.total_cost = data['total_cost']
+        summary.total_usage = data['total_usage']
+        for dimension in DIMENSIONS:
+            summary._cost[dimension].update(data['cost_by'][dimension])
+            summary._usage[dimension].update(data['usage_by'][dimension])
+        return summary
+
+    def to_dict(self) -> Dict:
+        return {
+            'rows': self.rows,
+            'total_cost': self.total_cost,
+            'total_usage': self.total_usage,
+            'cost_by': {dimension: dict(sorted(self._cost[dimension].items())) for dimension in DIMENSIONS},
+            'usage_by': {dimension: dict(sorted(self._usage[dimension].items())) for dimension in DIMENSIONS},
+        }
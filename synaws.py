@@ -0,0 +1,319 @@
+import argparse
+import json
+import os
+import queue
+import shutil
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from multiprocessing import get_context
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from cache import ResultCache
+from pricing import PricingIndex, default_pricing_index
+from summary import CostSummary
+from profiling import RunProfile, CAPTURE_MODES
+from incremental import append_missing_hours, make_state, save_state
+from data_generator import BillingDataGenerator, concat_chunks
+from patterns import PROFILE_SETS
+from cur_formatter import CURFormatter, CSV_COMPRESSIONS, PARQUET_COMPRESSIONS, clear_output_dir
+
+def _build_tasks(config: Dict[str, Dict[str, Dict[str, float]]], per_service: bool) -> List[Tuple[str, Dict[str, Dict]]]:
+    """Split the config into one task per region, or per region and service"""
+    tasks = []
+    for region, services in config.items():
+        services = {name: options for name, options in services.items() if options}
+        if not services:
+            continue
+        if per_service:
+            tasks.extend((region, {name: options}) for name, options in services.items())
+        else:
+            tasks.append((region, services))
+    return tasks
+
+# Day chunks a worker may send ahead of the parent, so the parent holds at most about workers x this many
+TASK_QUEUE_CHUNKS = 2
+
+# Chunk queues of a worker process, one per task slot, set by _init_worker
+_task_queues: List = []
+
+def _init_worker(queues: List):
+    global _task_queues
+    _task_queues = queues
+    # Forked workers inherit the parent's np.random state, so reseed each one for unseeded runs
+    np.random.seed()
+
+def _task_generator(task: Tuple[str, Dict[str, Dict]], days: int, generator_kwargs: Dict,
+                    profile: Optional[RunProfile] = None) -> BillingDataGenerator:
+    region, services = task
+    return BillingDataGenerator(services, region, days, profile=profile, **generator_kwargs)
+
+def _stream_task(task: Tuple[str, Dict[str, Dict]], days: int, generator_kwargs: Dict,
+                 profile: Optional[RunProfile], slot: int) -> Tuple[CostSummary, Optional[RunProfile]]:
+    """Generate one task in a pool worker, sending its day chunks through the slot's queue and then None"""
+    generator = _task_generator(task, days, generator_kwargs, profile)
+    chunks = _task_queues[slot]
+    for chunk in generator.iter_chunks(chunk_by='day'):
+        chunks.put(chunk)
+    chunks.put(None)
+    return generator.summary, profile
+
+def _drain(chunks, future: Future) -> Iterator[pd.DataFrame]:
+    """Yield a streaming task's chunks up to its end marker, raising the task's error if it failed"""
+    while True:
+        try:
+            chunk = chunks.get(timeout=0.5)
+        except queue.Empty:
+            # A finished task's last chunks can still be in flight, so only a failure ends the wait
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+            continue
+        if chunk is None:
+            return
+        yield chunk
+
+def _generator_kwargs(num_accounts: int, resources_per_option: int, seed: Optional[int],
+                      pricing: Optional[PricingIndex], patterns: str = 'classic') -> Dict:
+    """Generator options shared by every task; seeded runs pin one end date for all regions"""
+    if patterns not in PROFILE_SETS:
+        raise ValueError(f"Unknown pattern set: {patterns}")
+    kwargs = {'num_accounts': num_accounts, 'resources_per_option': resources_per_option, 'seed': seed,
+              'pricing': pricing or default_pricing_index(), 'usage_profiles': PROFILE_SETS[patterns]}
+    if seed is not None:
+        kwargs['end_date'] = datetime.combine(date.today(), datetime.min.time())
+    return kwargs
+
+def _iter_results(config: Dict[str, Dict[str, Dict[str, float]]], days: int,
+                  workers: Optional[int], per_service: bool, generator_kwargs: Dict,
+                  summary: Optional[CostSummary] = None, profile: Optional[RunProfile] = None) -> Iterator[pd.DataFrame]:
+    """Run the generator tasks in a process pool and yield their day chunks in config order
+
+    Workers stream chunks through bounded queues and at most one task per worker is in flight, so
+    memory depends on the number of workers and the size of a day, not on the size of the run.
+    Task summaries and profiles are merged into summary and profile as each task completes.
+    """
+    generator_kwargs['pricing'].validate_config(config)
+    tasks = _build_tasks(config, per_service)
+    if not tasks:
+        return
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers == 1:
+        # In-process tasks record straight into the caller's profile, nested under its open stages
+        for task in tasks:
+            generator = _task_generator(task, days, generator_kwargs, profile)
+            yield from generator.iter_chunks(chunk_by='day')
+            if summary is not None:
+                summary.merge(generator.summary)
+        return
+    # Workers time their stages into a fresh profile that comes back with the result to be merged
+    task_profile = RunProfile() if profile is not None and profile.enabled else None
+    context = get_context()
+    queues = [context.Queue(TASK_QUEUE_CHUNKS) for _ in range(workers)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(queues,)) as executor:
+        remaining = iter(tasks)
+        running = deque()
+
+        def submit(slot: int):
+            task = next(remaining, None)
+            if task is not None:
+                running.append((executor.submit(_stream_task, task, days, generator_kwargs, task_profile, slot), slot))
+
+        for slot in range(workers):
+            submit(slot)
+        try:
+            while running:
+                future, slot = running[0]
+                yield from _drain(queues[slot], future)
+                task_summary, worker_profile = future.result()
+                running.popleft()
+                if summary is not None:
+                    summary.merge(task_summary)
+                if worker_profile is not None:
+                    profile.merge(worker_profile)
+                submit(slot)
+        finally:
+            # When the consumer stops early, read the running tasks to their end so the workers can exit
+            for future, slot in running:
+                try:
+                    for _ in _drain(queues[slot], future):
+                        pass
+                except Exception:
+                    pass
+
+def generate(config: Dict[str, Dict[str, Dict[str, float]]], days: int,
+             workers: Optional[int] = None, per_service: bool = False,
+             num_accounts: int = 1, resources_per_option: int = 1,
+             seed: Optional[int] = None, pricing: Optional[PricingIndex] = None,
+             summary: Optional[CostSummary] = None, profile: Optional[RunProfile] = None,
+             patterns: str = 'classic') -> pd.DataFrame:
+    """Generate billing data for a region -> service -> option config across a process pool"""
+    profile = profile or RunProfile(enabled=False)
+    generator_kwargs = _generator_kwargs(num_accounts, resources_per_option, seed, pricing, patterns)
+    results = _iter_results(config, days, workers, per_service, generator_kwargs, summary, profile)
+    chunks = list(profile.timed('generate', results))
+    with profile.stage('concat') as stage:
+        df = concat_chunks(chunks)
+        stage.rows = len(df)
+    return df
+
+def _default_compression(output_format: str) -> str:
+    return 'snappy' if output_format == 'parquet' else 'none'
+
+def _write_output(results: Iterator[pd.DataFrame], output: str, output_format: str, compression: str,
+                  part_rows: Optional[int] = None, workers: Optional[int] = None) -> int:
+    if output_format == 'csv':
+        # Compressed or split CSV is written as a directory of part files with a manifest
+        if compression != 'none' or part_rows:
+            return CURFormatter.write_cur_csv_parts(results, output, compression, part_rows, workers)
+        return CURFormatter.write_cur_csv(results, output)
+    if output_format == 'parquet':
+        return CURFormatter.write_cur_parquet(results, output, compression)
+    raise ValueError(f"Unknown output format: {output_format}")
+
+def generate_to_file(config: Dict[str, Dict[str, Dict[str, float]]], days: int, output: str,
+                     workers: Optional[int] = None, per_service: bool = False,
+                     output_format: str = 'csv', compression: Optional[str] = None,
+                     num_accounts: int = 1, resources_per_option: int = 1,
+                     seed: Optional[int] = None, cache_dir: Optional[str] = None,
+                     cache_max_bytes: int = 1 << 30, pricing: Optional[PricingIndex] = None,
+                     summary: Optional[CostSummary] = None, part_rows: Optional[int] = None,
+                     profile: Optional[RunProfile] = None, patterns: str = 'classic') -> int:
+    """Generate billing data across a process pool and write it as a CSV file, CSV part directory or Parquet directory
+
+    compression defaults to snappy for Parquet and none for CSV. CSV with gzip or zstd compression,
+    or with part_rows set, is written as numbered part files plus a manifest in the output directory.
+    patterns names a usage profile set from patterns.PROFILE_SETS.
+    """
+    compression = compression or _default_compression(output_format)
+    profile = profile or RunProfile(enabled=False)
+    generator_kwargs = _generator_kwargs(num_accounts, resources_per_option, seed, pricing, patterns)
+    if cache_dir is None:
+        results = _iter_results(config, days, workers, per_service, generator_kwargs, summary, profile)
+        with profile.stage(f"write_{output_format}") as stage:
+            rows = _write_output(profile.timed('generate', results), output, output_format, compression,
+                                 part_rows, workers)
+            stage.rows = rows
+    else:
+        rows = _generate_cached(config, days, output, workers, per_service, output_format, compression,
+                                generator_kwargs, cache_dir, cache_max_bytes, summary, part_rows, profile, patterns)
+    if seed is not None:
+        # Seeded outputs record their state so they can be extended later with append_missing_hours;
+        # the pattern origin is the original start, so appended hours keep growing from the same point
+        end_date = generator_kwargs['end_date']
+        save_state(output, make_state(config, seed, end_date, output_format, compression,
+                                      num_accounts, resources_per_option, generator_kwargs['pricing'], part_rows,
+                                      patterns, end_date - timedelta(hours=int(round(days * 24)))))
+    return rows
+
+def _generate_cached(config: Dict[str, Dict[str, Dict[str, float]]], days: int, output: str,
+                     workers: Optional[int], per_service: bool, output_format: str, compression: str,
+                     generator_kwargs: Dict, cache_dir: str, cache_max_bytes: int,
+                     summary: Optional[CostSummary], part_rows: Optional[int] = None,
+                     profile: Optional[RunProfile] = None, patterns: str = 'classic') -> int:
+    """Copy the cached artifact for these inputs to output, generating it first on a miss"""
+    profile = profile or RunProfile(enabled=False)
+    seed = generator_kwargs['seed']
+    if seed is None:
+        raise ValueError("Caching requires a seed")
+
+    def build(entry_dir: str):
+        entry_summary = CostSummary()
+        results = _iter_results(config, days, workers, per_service, generator_kwargs, entry_summary, profile)
+        with profile.stage(f"write_{output_format}") as stage:
+            rows = _write_output(profile.timed('generate', results), os.path.join(entry_dir, 'artifact'),
+                                 output_format, compression, part_rows, workers)
+            stage.rows = rows
+        with open(os.path.join(entry_dir, 'rows.json'), 'w') as f:
+            json.dump(rows, f)
+        with open(os.path.join(entry_dir, 'summary.json'), 'w') as f:
+            json.dump(entry_summary.to_dict(), f)
+
+    cache = ResultCache(cache_dir, cache_max_bytes)
+    options = {name: value for name, value in generator_kwargs.items()
+               if name not in ('seed', 'pricing', 'usage_profiles')}
+    if patterns != 'classic':
+        # Keys of classic runs are left as they were so existing cache entries stay valid
+        options['patterns'] = patterns
+    key = ResultCache.make_key(config, days, seed, catalog=generator_kwargs['pricing'].version,
+                               per_service=per_service, output_format=output_format,
+                               compression=compression, part_rows=part_rows, **options)
+    entry_dir = cache.get_or_create(key, build)
+    artifact = os.path.join(entry_dir, 'artifact')
+    with profile.stage('copy_cached'):
+        if os.path.isdir(artifact):
+            # Like a fresh write, the copy replaces a previous output instead of merging into it
+            clear_output_dir(output)
+            shutil.copytree(artifact, output, dirs_exist_ok=True)
+        else:
+            shutil.copyfile(artifact, output)
+    if summary is not None:
+        with open(os.path.join(entry_dir, 'summary.json')) as f:
+            summary.merge(CostSummary.from_dict(json.load(f)))
+    with open(os.path.join(entry_dir, 'rows.json')) as f:
+        return json.load(f)
+
+def print_summary(summary: CostSummary):
+    print(f"Total cost: ${summary.total_cost:,.2f}")
+    for dimension in ('region', 'service', 'usage_type', 'account'):
+        print(f"\nCost by {dimension}:")
+        print(summary.cost_by(dimension).to_string(float_format=lambda cost: f"${cost:,.2f}"))
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog='synaws', description="Generate synthetic AWS billing data in CUR 2.0 format")
+    parser.add_argument('config', nargs='?', help="JSON file mapping regions to services to option values")
+    parser.add_argument('-o', '--output', required=True, help="CSV file, or directory for CSV part files or Parquet")
+    parser.add_argument('-d', '--days', type=int, default=30, help="Number of days of data to generate")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--per-service', action='store_true', help="Run one task per region and service instead of per region")
+    parser.add_argument('-f', '--format', choices=['csv', 'parquet'], default='csv', help="Output format")
+    parser.add_argument('--compression', choices=sorted(set(PARQUET_COMPRESSIONS) | set(CSV_COMPRESSIONS)), default=None,
+                        help="Compression codec: snappy (Parquet default), zstd, gzip or none (CSV default)")
+    parser.add_argument('--part-rows', type=int, default=None, help="Split CSV output into part files of at most this many rows")
+    parser.add_argument('--patterns', choices=sorted(PROFILE_SETS), default='classic',
+                        help="Usage pattern set: classic daily and weekly cycle, or realistic per-service profiles")
+    parser.add_argument('--accounts', type=int, default=1, help="Number of linked usage accounts")
+    parser.add_argument('--resources', type=int, default=1, help="Resource IDs per service option and account")
+    parser.add_argument('--seed', type=int, default=None, help="Seed for reproducible usage patterns and IDs")
+    parser.add_argument('--cache-dir', default=None, help="Reuse results for the same config and seed from this directory")
+    parser.add_argument('--cache-size', type=int, default=1024, help="Cache size limit in MB")
+    parser.add_argument('--catalog', default=None, help="JSON or CSV price file to use instead of the built-in catalog")
+    parser.add_argument('--summary', action='store_true', help="Print cost totals and rollups after generating")
+    parser.add_argument('--append', action='store_true', help="Extend a seeded output up to today instead of regenerating it")
+    parser.add_argument('--profile', action='store_true', help="Print time, rows and memory per pipeline stage")
+    parser.add_argument('--profile-capture', choices=CAPTURE_MODES, default=None,
+                        help="Also capture cProfile hotspots or tracemalloc allocation sites (implies --profile)")
+    args = parser.parse_args(argv)
+
+    pricing = PricingIndex.load(args.catalog) if args.catalog else None
+    if args.append:
+        rows = append_missing_hours(args.output, pricing=pricing)
+        print(f"Appended {rows} rows to {args.output}")
+        return
+    if args.config is None:
+        parser.error("a config file is required unless --append is given")
+    codecs = CSV_COMPRESSIONS if args.format == 'csv' else PARQUET_COMPRESSIONS
+    if args.compression is not None and args.compression not in codecs:
+        parser.error(f"--compression {args.compression} is not available for {args.format} output "
+                     f"(choose from {', '.join(sorted(codecs))})")
+    if args.cache_dir is not None and args.seed is None:
+        parser.error("--cache-dir requires --seed, since only seeded results can be reused")
+    with open(args.config) as f:
+        config = json.load(f)
+    summary = CostSummary()
+    profile = RunProfile(args.profile_capture, enabled=args.profile or args.profile_capture is not None)
+    with profile:
+        rows = generate_to_file(config, args.days, args.output, args.workers, args.per_service,
+                                args.format, args.compression, args.accounts, args.resources,
+                                args.seed, args.cache_dir, args.cache_size * 1024 * 1024, pricing, summary,
+                                args.part_rows, profile, args.patterns)
+    print(f"Wrote {rows} rows to {args.output}")
+    if args.summary:
+        print_summary(summary)
+    if profile.enabled:
+        print()
+        print(profile.report())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import os
+import sys
+from datetime import datetime
+from typing import Dict, List
+import pandas as pd
+import pytest
+
+# The modules live in the repository root rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import AWS_SERVICES
+
+END_DATE = datetime(2026, 1, 1)
+
+def first_options(service_name: str, count: int = 1) -> List[str]:
+    return [option.name for option in AWS_SERVICES[service_name].options[:count]]
+
+def sorted_strings(df: pd.DataFrame, drop: List[str] = ()) -> pd.DataFrame:
+    """A frame as strings in line item order, so frames built along different paths compare cell by cell"""
+    df = df.drop(columns=list(drop)).astype(str)
+    return df.sort_values('identity/LineItemId').reset_index(drop=True)
+
+@pytest.fixture
+def config() -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Two regions with a few options each, small enough to generate in well under a second"""
+    ec2, ebs = first_options('EC2', 2)
+    return {
+        'us-east-1': {'EC2': {ec2: 3, ebs: 1}, 'S3': {first_options('S3')[0]: 50}},
+        'us-west-2': {'S3': {first_options('S3')[0]: 20}, 'Lambda': {first_options('Lambda')[0]: 1000}},
+    }
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from data_generator import BillingDataGenerator, concat_chunks
+from patterns import SERVICE_PROFILES
+from conftest import END_DATE, sorted_strings
+
+@pytest.mark.parametrize('seed', [None, 7])
+def test_vectorized_engine_matches_legacy_except_ids(config, seed):
+    services = config['us-east-1']
+    np.random.seed(0)
+    vectorized = BillingDataGenerator(services, 'us-east-1', 2, seed=seed, end_date=END_DATE).generate_data()
+    np.random.seed(0)
+    legacy = BillingDataGenerator(services, 'us-east-1', 2, seed=seed, end_date=END_DATE).generate_data('legacy')
+
+    ids = ['identity/LineItemId', 'lineItem/ResourceId']
+    assert len(vectorized) == len(legacy) == 3 * 48
+    assert (vectorized.drop(columns=ids).astype(str).to_numpy() == legacy.drop(columns=ids).astype(str).to_numpy()).all()
+
+@pytest.mark.parametrize('seed', [None, 7])
+def test_day_chunks_match_option_chunks(config, seed):
+    generator = BillingDataGenerator(config['us-east-1'], 'us-east-1', 3, num_accounts=2, resources_per_option=2,
+                                     seed=seed, end_date=END_DATE)
+    by_option = generator.generate_data()
+    by_day = concat_chunks(list(generator.iter_chunks(chunk_by='day')))
+    assert sorted_strings(by_day).equals(sorted_strings(by_option))
+
+def test_follower_noise_is_correlated_not_copied():
+    generator = BillingDataGenerator({'Lambda': {'Requests': 1000}}, 'us-east-1', 30, seed=1, end_date=END_DATE,
+                                     usage_profiles=SERVICE_PROFILES)
+    hour = generator.first_epoch_hour
+    requests = generator._profile_patterns('Lambda', 'Requests', 100.0, hour, 720)[0]
+    compute = generator._profile_patterns('Lambda', 'Compute (GB-seconds)', 100.0, hour, 720)[0]
+    correlation = np.corrcoef(requests, compute)[0, 1]
+    assert 0.5 < correlation < 0.999
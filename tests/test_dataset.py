@@ -0,0 +1,25 @@
+import pandas as pd
+import pytest
+from dataset import BillingDataset
+from conftest import END_DATE, sorted_strings
+
+@pytest.fixture
+def dataset(config) -> BillingDataset:
+    return BillingDataset(config, 4, 11, end_date=END_DATE, num_accounts=2, resources_per_option=2)
+
+def test_slice_matches_rows_of_full_dataset(dataset):
+    full = dataset.to_frame()
+    start, end = pd.Timestamp('2025-12-29 06:00'), pd.Timestamp('2025-12-30 18:00')
+    view = dataset.slice(regions='us-west-2', services='S3', start=start, end=end)
+
+    expected = full[(full['product/region'] == 'us-west-2') & (full['lineItem/ProductCode'] == 'S3')
+                    & (full['lineItem/UsageStartDate'] >= start) & (full['lineItem/UsageStartDate'] < end)]
+    part = view.to_frame()
+    assert len(part) == view.rows == 36 * dataset.num_series
+    assert sorted_strings(part).equals(sorted_strings(expected))
+
+def test_slice_is_clipped_to_window(dataset):
+    view = dataset.slice(start='2020-01-01', end='2030-01-01')
+    assert (view.start_date, view.end_date) == (dataset.start_date, dataset.end_date)
+    with pytest.raises(ValueError, match='Region not in dataset'):
+        dataset.slice(regions='eu-west-1')
@@ -0,0 +1,38 @@
+from datetime import timedelta
+import pandas as pd
+from cur_formatter import CURFormatter
+from dataset import BillingDataset
+from incremental import append_missing_hours, load_state
+from synaws import generate_to_file
+from conftest import sorted_strings
+
+BILLING_PERIOD = ['bill/BillingPeriodStartDate', 'bill/BillingPeriodEndDate']
+
+def test_append_matches_full_regeneration(config, tmp_path):
+    output = str(tmp_path / 'billing.csv')
+    generate_to_file(config, 2, output, workers=1, seed=5)
+    state = load_state(output)
+    until = pd.Timestamp(state['end_date']).to_pydatetime() + timedelta(days=1)
+    first = pd.read_csv(output, dtype=str)
+
+    appended = append_missing_hours(output, until)
+    extended = pd.read_csv(output, dtype=str)
+    full_path = str(tmp_path / 'full.csv')
+    CURFormatter.write_cur_csv(BillingDataset(config, 3, 5, end_date=until).iter_chunks(), full_path)
+    full = pd.read_csv(full_path, dtype=str)
+
+    assert appended == len(extended) - len(first) == len(full) // 3
+    # Appended rows keep the output's original billing period; everything else matches a full regeneration
+    assert extended[BILLING_PERIOD].drop_duplicates().equals(first[BILLING_PERIOD].drop_duplicates())
+    assert sorted_strings(extended, BILLING_PERIOD).equals(sorted_strings(full, BILLING_PERIOD))
+    assert append_missing_hours(output, until) == 0
+
+def test_from_output_matches_appended_output(config, tmp_path):
+    output = str(tmp_path / 'billing.csv')
+    generate_to_file(config, 2, output, workers=1, seed=5)
+    until = pd.Timestamp(load_state(output)['end_date']).to_pydatetime() + timedelta(hours=30)
+    append_missing_hours(output, until)
+
+    regenerated = str(tmp_path / 'regenerated.csv')
+    CURFormatter.write_cur_csv(BillingDataset.from_output(output).iter_chunks(), regenerated)
+    assert sorted_strings(pd.read_csv(regenerated, dtype=str)).equals(sorted_strings(pd.read_csv(output, dtype=str)))
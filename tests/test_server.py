@@ -0,0 +1,78 @@
+import json
+import socket
+import threading
+import urllib.error
+import urllib.request
+import pytest
+from pricing import default_pricing_index
+from server import GenerationServer, JobQueue, parse_request
+from conftest import first_options
+
+def _body(**fields):
+    return {'config': {'us-east-1': {'EC2': {first_options('EC2')[0]: 1}}}, **fields}
+
+@pytest.mark.parametrize('body', [
+    None,
+    {'config': {'us-east-1': 'EC2'}},
+    {'config': {'us-east-1': {'EC2': {'no such option': 1}}}},
+    {'config': {'us-east-1': {'EC2': {first_options('EC2')[0]: 'one'}}}},
+    _body(days=[1]),
+    _body(days=1.5),
+    _body(days=float('inf')),
+    _body(days='abc'),
+    _body(days=0),
+    _body(days=100000),
+    _body(accounts=1000, resources=1000),
+    _body(seed=-1),
+    _body(part_rows=0),
+    _body(format='xml'),
+    _body(format='csv', compression='snappy'),
+    _body(patterns='chaotic'),
+    _body(colour='blue'),
+])
+def test_parse_request_rejects_bad_requests(body):
+    with pytest.raises(ValueError):
+        parse_request(body, default_pricing_index())
+
+def test_parse_request_fills_defaults():
+    request = parse_request(_body(days=2.0, seed='7'), default_pricing_index())
+    assert (request['days'], request['seed'], request['format'], request['accounts']) == (2, 7, 'csv', 1)
+
+@pytest.fixture
+def server(tmp_path):
+    queue = JobQueue(str(tmp_path), max_workers=1)
+    server = GenerationServer(('127.0.0.1', 0), queue, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    queue.shutdown()
+
+def _post(server, data: bytes):
+    request = urllib.request.Request(f"http://127.0.0.1:{server.server_address[1]}/jobs", data)
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read())
+
+def test_bad_bodies_get_400(server):
+    for data in (b'{"config": {"us-east-1": "EC2"}}', b'{"days": [1]}', b'{"config": {}, "days": 1e400}', b'{'):
+        status, payload = _post(server, data)
+        assert status == 400 and payload['error']
+
+@pytest.mark.parametrize('length', ['abc', '-1'])
+def test_bad_content_length_gets_400(server, length):
+    with socket.create_connection(server.server_address, timeout=10) as connection:
+        connection.sendall(f"POST /jobs HTTP/1.1\r\nHost: test\r\nConnection: close\r\n"
+                           f"Content-Length: {length}\r\n\r\n".encode())
+        assert connection.recv(64).startswith(b'HTTP/1.1 400')
+
+def test_bad_timeout_gets_400(server):
+    status, job = _post(server, json.dumps(_body(days=1)).encode())
+    assert status == 202
+    for timeout in ('abc', 'inf', '-1'):
+        url = f"http://127.0.0.1:{server.server_address[1]}/jobs/{job['id']}/result?timeout={timeout}"
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(url, timeout=10)
+        assert error.value.code == 400
@@ -0,0 +1,51 @@
+import json
+import os
+import pandas as pd
+import pytest
+from synaws import generate_to_file, main
+
+def _read_parquet(path: str) -> pd.DataFrame:
+    pytest.importorskip('pyarrow')
+    return pd.read_parquet(path)
+
+def test_worker_count_does_not_change_output(config, tmp_path):
+    outputs = []
+    for workers in (1, 2):
+        outputs.append(tmp_path / f"workers-{workers}.csv")
+        generate_to_file(config, 2, str(outputs[-1]), workers=workers, seed=3)
+    assert outputs[0].read_bytes() == outputs[1].read_bytes()
+
+@pytest.mark.parametrize('output_format, compression', [('parquet', None), ('csv', 'gzip')])
+def test_fresh_rerun_replaces_existing_directory(config, tmp_path, output_format, compression):
+    output = str(tmp_path / 'billing')
+    rows = [generate_to_file(config, 2, output, workers=1, output_format=output_format, compression=compression,
+                             seed=3) for _ in range(2)]
+    if output_format == 'parquet':
+        df = _read_parquet(output)
+    else:
+        with open(os.path.join(output, 'billing-Manifest.json')) as f:
+            manifest = json.load(f)
+        assert manifest['rowCounts'] == [rows[1]]
+        df = pd.concat(pd.read_csv(os.path.join(output, key)) for key in manifest['reportKeys'])
+    assert len(df) == rows[1] == df['identity/LineItemId'].nunique()
+
+def test_cached_rerun_replaces_existing_directory(config, tmp_path):
+    output = str(tmp_path / 'billing')
+    for _ in range(2):
+        rows = generate_to_file(config, 2, output, workers=1, output_format='parquet', seed=3,
+                                cache_dir=str(tmp_path / 'cache'))
+    df = _read_parquet(output)
+    assert len(df) == rows == df['identity/LineItemId'].nunique()
+
+def test_fresh_write_refuses_directory_with_other_files(config, tmp_path):
+    (tmp_path / 'notes.txt').write_text('keep me')
+    with pytest.raises(ValueError, match='not CUR output'):
+        generate_to_file(config, 1, str(tmp_path), workers=1, compression='gzip', seed=3)
+    assert (tmp_path / 'notes.txt').exists()
+
+def test_compression_must_match_format(config, tmp_path, capsys):
+    config_path = tmp_path / 'config.json'
+    config_path.write_text(json.dumps(config))
+    with pytest.raises(SystemExit):
+        main([str(config_path), '-o', str(tmp_path / 'billing.csv'), '-f', 'csv', '--compression', 'snappy'])
+    assert 'not available for csv output' in capsys.readouterr().err